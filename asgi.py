@@ -0,0 +1,318 @@
+"""
+ASGI 入口（可选的部署方式，与 gunicorn + app:app 二选一）
+
+/extract、/stats、/stats/watch（及 /pools/<name>/ 前缀的同名接口）用 SQLAlchemy asyncio 引擎原生异步处理：
+等待行锁、挂起的长轮询都只占一个协程，不占线程，一个进程可以同时挂着几百个客户端。
+其余接口原样交给 app.py 的 Flask 应用（在线程池里执行）。
+
+    pip install starlette uvicorn a2wsgi aiomysql     # 本地 SQLite 测试用 aiosqlite
+    uvicorn asgi:app --host 0.0.0.0 --port 5500 --workers 2
+
+多个 worker 时同样需要设置 PROMETHEUS_MULTIPROC_DIR（见 gunicorn.conf.py）。
+
+- 数据库地址与 app.py 相同（pools.json / DB_*），驱动自动换成异步驱动（aiomysql / aiosqlite / asyncpg）
+- 每个请求最长执行 ASGI_REQUEST_TIMEOUT 秒，超时返回 504；客户端断开时取消请求。
+  取消时未提交的认领随事务回滚，账号不会被标记为已使用
+- /stats/watch 每个账号池只有一个后台任务读计数器，挂起的请求只等通知，不各自轮询数据库
+- 认领逻辑与 app.py 完全相同（通过 AsyncSession.run_sync 调用 run_extract），读取不走只读副本；
+  在认领队列里排队时只挂起协程
+"""
+from contextlib import asynccontextmanager, suppress
+import asyncio
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.util import await_only
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+import app as wsgi
+import metrics
+import profiling
+
+# ----------------------------
+# 配置
+# ----------------------------
+ASGI_REQUEST_TIMEOUT = float(os.getenv("ASGI_REQUEST_TIMEOUT", "30"))  # 秒，/extract、/stats 的最长执行时间
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "32"))          # 执行其余 Flask 接口的线程数
+DISCONNECT_POLL = 0.5  # 秒，检查客户端是否断开的间隔
+
+_ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mariadb": "mariadb+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+_engines = {}
+_watchers = {}
+
+
+# ----------------------------
+# 异步引擎
+# ----------------------------
+def async_url(url):
+    """把同步驱动的地址换成对应的异步驱动（mysql+pymysql -> mysql+aiomysql 等）"""
+    url = make_url(url)
+    return url.set(drivername=_ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def get_async_engine(pool):
+    """每个账号池一个异步引擎（本进程内），连接池参数与同步引擎相同"""
+    engine = _engines.get(pool.name)
+    if engine is None:
+        options = {"pool_pre_ping": pool.pre_ping, "pool_recycle": pool.pool_recycle}
+        if not pool.url.startswith("sqlite"):
+            options.update(pool_size=pool.pool_size, max_overflow=pool.max_overflow,
+                           pool_timeout=pool.pool_timeout)
+        engine = _engines[pool.name] = create_async_engine(async_url(pool.url), **options)
+        metrics.instrument_engine(engine.sync_engine, pool.name)
+        profiling.instrument_engine(engine.sync_engine, pool.name)
+    return engine
+
+
+# ----------------------------
+# 统计订阅
+# ----------------------------
+class StatsWatcher:
+    """
+    一个账号池的计数器订阅：有请求挂起时，后台任务每 STATS_WATCH_POLL 秒（或本进程提取之后）读一次计数器，
+    版本号变化时唤醒所有等待的请求
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.counters = None
+        self.changed = asyncio.Condition()
+        self.poke = asyncio.Event()
+        self.waiters = 0
+        self._task = None
+
+    async def load(self):
+        """读一次计数器（计数器未初始化时先对账），并通知等待的请求"""
+        async with AsyncSession(get_async_engine(self.pool)) as session:
+            counters = await session.run_sync(wsgi.read_counters)
+        if counters is None:
+            await asyncio.to_thread(wsgi.reconcile_counters, self.pool)
+            async with AsyncSession(get_async_engine(self.pool)) as session:
+                counters = await session.run_sync(wsgi.read_counters)
+        async with self.changed:
+            if counters != self.counters:
+                self.counters = counters
+                self.changed.notify_all()
+        return counters
+
+    async def wait(self, since, timeout):
+        """等待版本号不等于 since，返回最新的计数器；超时返回 None"""
+        self.waiters += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        try:
+            async with self.changed:
+                await asyncio.wait_for(
+                    self.changed.wait_for(lambda: self.counters is not None and self.counters[2] != since),
+                    timeout
+                )
+                return self.counters
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.waiters -= 1
+
+    async def _run(self):
+        # 任务复制了第一个等待的请求的上下文，这里的 SQL 不计入那个请求的剖析
+        profiling.detach()
+        # 检查 waiters 和退出之间没有 await，新来的请求要么被这一轮看到，要么会重新启动任务
+        while self.waiters:
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"⚠️ 账号池 {self.pool.name} 读取统计计数器失败: {e}")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.poke.wait(), wsgi.STATS_WATCH_POLL)
+            self.poke.clear()
+        self._task = None
+
+
+def get_watcher(pool):
+    watcher = _watchers.get(pool.name)
+    if watcher is None:
+        watcher = _watchers[pool.name] = StatsWatcher(pool)
+    return watcher
+
+
+def _stats_response(request, counters, status_code=200):
+    total, used, version = counters
+    etag = f'"{version}-{total}-{used}"'
+    if status_code == 304 or etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(
+        {"total": total, "used": used, "unused": total - used, "version": version},
+        headers={"ETag": etag}
+    )
+
+
+# ----------------------------
+# 请求处理
+# ----------------------------
+async def run_cancellable(request, coro, timeout=ASGI_REQUEST_TIMEOUT):
+    """
+    执行 coro 并返回它的结果；超过 timeout 秒返回 504，客户端断开时返回 499。
+    两种情况都会取消 coro 并等它退出（AsyncSession 关闭时回滚未提交的事务）。
+    """
+    task = asyncio.ensure_future(coro)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            done, _ = await asyncio.wait({task}, timeout=max(min(DISCONNECT_POLL, remaining), 0))
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                return Response(status_code=499)
+            if remaining <= 0:
+                return JSONResponse({"error": "Request timed out"}, status_code=504)
+    finally:
+        if not task.done():
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+
+def pool_endpoint(view):
+    """与 app.pool_route 相同：解析账号池（未知时 404），并记录接口耗时指标和请求剖析"""
+    async def endpoint(request):
+        pool_name = request.path_params.get("pool_name")
+        pool = wsgi.POOLS.get(pool_name or wsgi.DEFAULT_POOL)
+        if pool is None:
+            return JSONResponse({"error": f"Unknown pool '{pool_name}'"}, status_code=404)
+
+        route = request.scope["route"].path
+        start = time.perf_counter()
+        metrics.REQUESTS_IN_PROGRESS.labels(route).inc()
+        profile = profiling.start_request(route, request.method, request.headers.get(profiling.PROFILE_HEADER))
+        status = 500
+        try:
+            response = await view(request, pool)
+            status = response.status_code
+            timing = profiling.server_timing(profile)
+            if timing:
+                response.headers["Server-Timing"] = timing
+            return response
+        finally:
+            profiling.finish_request(profile, status)
+            metrics.REQUESTS_IN_PROGRESS.labels(route).dec()
+            metrics.REQUEST_LATENCY.labels(route, request.method, str(status)).observe(time.perf_counter() - start)
+    return endpoint
+
+
+async def _wait_ticket(ticket, timeout):
+    loop = asyncio.get_running_loop()
+    granted = loop.create_future()
+
+    def on_grant():
+        loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+    ticket.on_grant = on_grant
+    if ticket.granted.is_set():
+        return True
+    with suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(granted, timeout)
+    return ticket.granted.is_set()
+
+
+def _wait_in_loop(ticket, timeout):
+    # run_extract 在 run_sync 里执行，不能阻塞事件循环：与执行 SQL 一样把等待交回事件循环
+    return await_only(_wait_ticket(ticket, timeout))
+
+
+async def _extract(pool, count, extractor, request_id):
+    async with AsyncSession(get_async_engine(pool)) as session:
+        return await session.run_sync(
+            lambda sync_session: wsgi.run_extract(pool, sync_session, count, extractor, request_id, _wait_in_loop))
+
+
+async def extract(request, pool):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    try:
+        count, extractor, request_id = wsgi.parse_extract_request(data, request.headers.get("idempotency-key"))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    try:
+        result = await run_cancellable(request, _extract(pool, count, extractor, request_id))
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    if isinstance(result, Response):
+        return result
+
+    body, status, headers = result
+    if status == 200:
+        get_watcher(pool).poke.set()
+    return Response(body, status_code=status, media_type="application/json", headers=headers)
+
+
+async def stats(request, pool):
+    result = await run_cancellable(request, get_watcher(pool).load())
+    if isinstance(result, Response):
+        return result
+    return _stats_response(request, result)
+
+
+async def stats_watch(request, pool):
+    try:
+        since = int(request.query_params["since"]) if "since" in request.query_params else None
+        timeout = int(request.query_params.get("timeout", wsgi.STATS_WATCH_TIMEOUT))
+    except ValueError:
+        since, timeout = None, wsgi.STATS_WATCH_TIMEOUT
+    timeout = max(min(timeout, wsgi.STATS_WATCH_TIMEOUT), 0)
+
+    watcher = get_watcher(pool)
+    counters = await run_cancellable(request, watcher.load())
+    if isinstance(counters, Response):
+        return counters
+    if since is None or counters[2] != since:
+        return _stats_response(request, counters)
+
+    result = await run_cancellable(request, watcher.wait(since, timeout), timeout=timeout + 1)
+    if isinstance(result, Response):
+        return result
+    if result is None:
+        return _stats_response(request, counters, status_code=304)
+    return _stats_response(request, result)
+
+
+def pool_routes(path, view, methods):
+    endpoint = pool_endpoint(view)
+    return [
+        Route(path, endpoint, methods=methods),
+        Route(f"/pools/{{pool_name}}{path}", endpoint, methods=methods),
+    ]
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    # Flask 接口第一次被请求时才会启动维护线程，这里提前启动（对账、归档、清理幂等记录）
+    wsgi._ensure_maintenance()
+    yield
+    for engine in _engines.values():
+        await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        *pool_routes("/extract", extract, ["POST"]),
+        *pool_routes("/stats", stats, ["GET"]),
+        *pool_routes("/stats/watch", stats_watch, ["GET"]),
+        # 其余接口由 Flask 处理
+        Mount("/", app=WSGIMiddleware(wsgi.app, workers=ASGI_WSGI_THREADS)),
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,182 @@
+"""
+进程内预认领账号缓冲区（可选，默认关闭）
+
+每个 worker 预先把一批未使用账号标记为 reserved（reserved_by=本进程），小批量 /extract
+直接从本地缓冲区取 id，只需一条 UPDATE 把它们标记为 used 并写入 extracted_by/extracted_at，
+省掉锁定 + 查询的开销。
+
+- 缓冲区低于低水位时由后台线程补货
+- 后台线程定期刷新缓冲区里还没发出的行的 reserved_at；超过 TTL 仍未刷新的预留（进程崩溃、
+  已经发出但请求失败回滚的行）会被放回池中
+- 进程正常退出时把未发出的账号放回池中（status='unused'）
+"""
+from collections import deque
+from datetime import datetime, timedelta
+import atexit
+import os
+import socket
+import threading
+
+from sqlalchemy import select, update
+
+
+class ExtractBuffer:
+    def __init__(self, session_factory, model, claim, size=200, low_water=50, max_count=5, reserve_ttl=600):
+        """claim(session, count, values) 按 id 顺序认领未使用账号，返回 (id, account) 行"""
+        self.session_factory = session_factory
+        self.model = model
+        self.claim = claim
+        self.size = size
+        self.low_water = low_water
+        self.max_count = max_count
+        self.reserve_ttl = reserve_ttl
+
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._pid = None
+        self.owner = None
+
+    # ----------------------------
+    # 对外接口
+    # ----------------------------
+    def accepts(self, count):
+        """是否由缓冲区处理这次提取（只处理小批量）"""
+        return count <= self.max_count
+
+    def take(self, session, count, extractor, now):
+        """
+        从缓冲区发出至多 count 个账号，标记为已使用并返回 (id, account) 列表（调用方负责 commit）。
+        缓冲区不足时返回 None，由调用方走直接认领的路径。
+        只在调用方的事务里执行语句，不提交也不回滚（事务里可能还有 /extract 幂等记录等）。
+        调用方回滚时这些行仍是本进程的预留，但已经不在缓冲区里、不会再续期，TTL 之后被回收。
+        """
+        self._ensure_started()
+        with self._lock:
+            if len(self._pending) < count:
+                self._wakeup.set()
+                return None
+            taken = [self._pending.popleft() for _ in range(count)]
+            if len(self._pending) <= self.low_water:
+                self._wakeup.set()
+
+        Account = self.model
+        ids = [row_id for row_id, _ in taken]
+        # 先锁住仍属于本进程的预留，确认全部还在之后再标记，不会把别人已经认领的行改回去
+        reserved = session.execute(
+            select(Account.id)
+            .where(Account.id.in_(ids), Account.status == 'reserved', Account.reserved_by == self.owner)
+            .with_for_update()
+        ).scalars().all()
+        if len(reserved) != len(ids):
+            # 部分预留已被超时回收（可能已被别人认领）：把剩下的预留放回池中，由调用方直接认领
+            if reserved:
+                session.execute(
+                    update(Account)
+                    .where(Account.id.in_(reserved), Account.status == 'reserved', Account.reserved_by == self.owner)
+                    .values(status='unused', reserved_by=None, reserved_at=None)
+                    .execution_options(synchronize_session=False)
+                )
+            return None
+
+        session.execute(
+            update(Account)
+            .where(Account.id.in_(ids), Account.status == 'reserved', Account.reserved_by == self.owner)
+            .values(status='used', extracted_by=extractor, extracted_at=now, reserved_by=None, reserved_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        return taken
+
+    def release(self):
+        """把本进程未发出的预留账号放回池中"""
+        if self.owner is None:
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        with self._lock:
+            self._pending.clear()
+        Account = self.model
+        session = self.session_factory()
+        try:
+            session.execute(
+                update(Account)
+                .where(Account.status == 'reserved', Account.reserved_by == self.owner)
+                .values(status='unused', reserved_by=None, reserved_at=None)
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+        finally:
+            session.close()
+
+    # ----------------------------
+    # 后台补货
+    # ----------------------------
+    def _ensure_started(self):
+        # gunicorn fork 之后每个 worker 第一次使用时各自启动线程
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self.owner = f"{socket.gethostname()}:{pid}"[:64]
+            self._pending.clear()
+            self._stopped.clear()
+            self._wakeup.set()
+            threading.Thread(target=self._run, name="extract-buffer", daemon=True).start()
+            atexit.register(self.release)
+
+    def _run(self):
+        heartbeat = max(self.reserve_ttl / 3, 1)
+        while not self._stopped.is_set():
+            self._wakeup.wait(heartbeat)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self._refill()
+            except Exception as e:
+                print(f"⚠️ 预认领缓冲区补货失败: {e}")
+
+    def _refill(self):
+        Account = self.model
+        now = datetime.utcnow()
+        session = self.session_factory()
+        try:
+            # 回收超时的预留（所属进程已经不在了，或者发出后请求回滚了），并刷新缓冲区里还没发出的行
+            session.execute(
+                update(Account)
+                .where(Account.status == 'reserved',
+                       Account.reserved_at < now - timedelta(seconds=self.reserve_ttl))
+                .values(status='unused', reserved_by=None, reserved_at=None)
+            )
+            with self._lock:
+                pending_ids = [row_id for row_id, _ in self._pending]
+            if pending_ids:
+                session.execute(
+                    update(Account)
+                    .where(Account.id.in_(pending_ids), Account.status == 'reserved',
+                           Account.reserved_by == self.owner)
+                    .values(reserved_at=now, updated_at=Account.updated_at)  # 续期不算修改，不进入 /changes
+                )
+
+            with self._lock:
+                need = self.size - len(self._pending)
+            rows = []
+            if need > self.low_water or not self._pending:
+                # 与直接提取相同的认领方式：SKIP LOCKED / UPDATE ... RETURNING
+                rows = self.claim(session, need, dict(
+                    status='reserved', reserved_by=self.owner, reserved_at=now))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        if rows:
+            with self._lock:
+                self._pending.extend((row.id, row.account) for row in rows)
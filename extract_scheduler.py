@@ -0,0 +1,128 @@
+"""
+/extract 调度：每个 worker 一个有界等待队列，认领名额按 extractor 轮流发放
+
+- 同时执行的认领（一个批次占一个名额）不超过 concurrency；名额空出来时按 extractor 轮转，
+  每轮每个 extractor 只发一个批次。大请求被拆成多个批次，每批结束后重新排到队尾，
+  一个要 10000 个账号的脚本不会让其他 extractor 一直等下去
+- 排队的批次超过 max_queue 时直接拒绝，等待超过 timeout 秒放弃，都抛出 QueueBusy
+"""
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import threading
+import time
+
+import metrics
+
+
+class QueueBusy(Exception):
+    """队列已满或排队超时"""
+
+
+class Ticket:
+    def __init__(self, extractor):
+        self.extractor = extractor
+        self.enqueued_at = time.perf_counter()
+        self.granted = threading.Event()
+        # 拿到名额后调用（asgi.py 用它唤醒事件循环里等待的协程）
+        self.on_grant = None
+
+
+class ExtractScheduler:
+    def __init__(self, name, concurrency=4, max_queue=64):
+        self.concurrency = max(concurrency, 1)
+        self.max_queue = max_queue
+
+        self._queues = OrderedDict()  # extractor -> 等待的 Ticket，顺序即轮转顺序
+        self._waiting = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+        self._depth = metrics.EXTRACT_QUEUE_DEPTH.labels(name)
+        self._running = metrics.EXTRACT_ACTIVE.labels(name)
+        self._wait_time = metrics.EXTRACT_QUEUE_WAIT.labels(name)
+
+    # ----------------------------
+    # 对外接口
+    # ----------------------------
+    @contextmanager
+    def slot(self, extractor, timeout, wait=None):
+        """
+        占用一个认领名额执行 with 块。
+        wait(ticket, timeout) 负责等待 ticket.granted，返回是否拿到名额；默认阻塞当前线程。
+        """
+        ticket = self.enqueue(extractor)
+        try:
+            granted = (wait or _wait_thread)(ticket, timeout)
+        except BaseException:
+            if not self.cancel(ticket):
+                self.release()
+            raise
+        if not granted and self.cancel(ticket):
+            raise QueueBusy(f"Timed out after {timeout:g}s waiting in the extract queue")
+        try:
+            yield
+        finally:
+            self.release()
+
+    def enqueue(self, extractor):
+        """排队；有空闲名额且没人排队时立即拿到名额。队列已满时抛出 QueueBusy"""
+        ticket = Ticket(extractor)
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                raise QueueBusy("Extract queue is full")
+            self._queues.setdefault(extractor, deque()).append(ticket)
+            self._waiting += 1
+            granted = self._dispatch()
+        self._notify(granted)
+        return ticket
+
+    def cancel(self, ticket):
+        """放弃排队；已经拿到名额时返回 False（调用方需要 release）"""
+        with self._lock:
+            if ticket.granted.is_set():
+                return False
+            queue = self._queues.get(ticket.extractor)
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.extractor]
+            self._waiting -= 1
+            self._depth.set(self._waiting)
+            return True
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            granted = self._dispatch()
+        self._notify(granted)
+
+    # ----------------------------
+    # 内部
+    # ----------------------------
+    def _dispatch(self):
+        # 持有 _lock 时调用：按轮转顺序把空闲名额发给各 extractor 的第一个 Ticket
+        granted = []
+        while self._active < self.concurrency and self._queues:
+            extractor, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(extractor)
+            else:
+                del self._queues[extractor]
+            self._waiting -= 1
+            self._active += 1
+            ticket.granted.set()
+            granted.append(ticket)
+        self._depth.set(self._waiting)
+        self._running.set(self._active)
+        return granted
+
+    def _notify(self, granted):
+        now = time.perf_counter()
+        for ticket in granted:
+            self._wait_time.observe(now - ticket.enqueued_at)
+            if ticket.on_grant is not None:
+                ticket.on_grant()
+
+
+def _wait_thread(ticket, timeout):
+    return ticket.granted.wait(timeout)
@@ -0,0 +1,28 @@
+# gunicorn 配置：gunicorn -c gunicorn.conf.py app:app
+# 命令行参数（--bind / --workers 等）仍然可以覆盖这里的设置
+import os
+
+# /stats/watch 长轮询每个客户端最长挂起 STATS_WATCH_TIMEOUT 秒（默认 25）：必须用多线程 worker，
+# 否则一个挂起的客户端就占满一个 sync worker，/extract 只能排队
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+
+# /metrics 多进程汇总目录：必须在 worker 导入 app / metrics 之前设置，每次启动时清空
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/vmq-prometheus")
+
+
+def on_starting(server):
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        os.remove(os.path.join(path, name))
+
+
+def child_exit(server, worker):
+    # 清理已退出 worker 的 livesum 指标。直接调用 prometheus_client，不导入 metrics
+    # （导入 metrics 会在 master 进程里创建全部指标对象）
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid, os.environ["PROMETHEUS_MULTIPROC_DIR"])
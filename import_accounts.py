@@ -0,0 +1,267 @@
+"""
+批量导入账号（命令行，直接写数据库，不经过 /add_accounts）
+
+逐行读取文本或 CSV 文件，按块去重入库，适合几百万行的大文件:
+    python import_accounts.py accounts.txt                    # 默认账号池
+    python import_accounts.py accounts.txt --pool bianfu
+    python import_accounts.py accounts.csv --column account   # CSV 按列名取账号
+    python import_accounts.py accounts.txt --split-fields     # 只取每行 ---- 前的第一段作为账号
+
+文本文件默认整行作为账号（与客户端导入、/add_accounts 一致，库里已有的账号也是整行，如 BzFuTi168----白洲）；
+导出文件的表头行会被跳过。
+注意：--split-fields 导入的 BzFuTi168 与库里已有的 BzFuTi168----白洲 是两个不同的账号，不会被去重，
+已经提取过的账号会以 unused 状态重新入库、再次被提取。只有文件和库里的账号本来就是拆分后的格式时才使用。
+与 app.py 使用同样的账号池配置（pools.json 或 DB_* 环境变量）。
+
+入库方式:
+    MySQL 默认用 LOAD DATA LOCAL INFILE（需要服务器开启 local_infile），失败时自动改用多行 INSERT IGNORE；
+    SQLite / PostgreSQL 用多行 INSERT ... ON CONFLICT DO NOTHING（与 /add_accounts 相同）。
+
+每块提交后把读到的文件位置写入 <文件名>.import-checkpoint.json，中断后重新执行同一命令会从该位置继续；
+全部导入完成后删除检查点。加 --restart 忽略检查点从头导入。重复导入同一块是安全的（已存在的账号会被跳过）。
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app import POOLS, DEFAULT_POOL, account_digest, bump_counters, drop_archived_duplicates, insert_accounts_chunk
+
+# 每个事务导入的账号数
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "20000"))
+# 文本文件的字段分隔符
+FIELD_SEPARATOR = "----"
+# 导出文件的表头行
+EXPORT_HEADER_PREFIXES = ("====", "数据导出时间:", "总记录数:")
+
+
+# ----------------------------
+# 解析
+# ----------------------------
+def iter_file_accounts(path, fmt, column=None, split_fields=False, offset=0):
+    """
+    逐行读取文件，产出 (读完这一行之后的文件字节位置, 账号)。
+    按字节读取，offset 可以直接 seek，中断后从检查点继续。
+    """
+    with open(path, 'rb') as f:
+        index = 0
+        if fmt == 'csv':
+            # 表头总是从文件开头读取；没指定列名且表头里没有 account 列时，取第一列并把第一行当作数据
+            header = next(csv.reader([f.readline().decode('utf-8-sig', errors='replace')]), [])
+            if column:
+                if column not in header:
+                    raise SystemExit(f"CSV 表头中没有列 {column}（表头: {', '.join(header)}）")
+                index = header.index(column)
+            elif 'account' in header:
+                index = header.index('account')
+            else:
+                f.seek(0)
+        if offset:
+            f.seek(offset)
+        elif fmt != 'csv':
+            # 跳过 UTF-8 BOM
+            if f.read(3) != b'\xef\xbb\xbf':
+                f.seek(0)
+
+        position = f.tell()
+        for raw in f:
+            position += len(raw)
+            line = raw.decode('utf-8', errors='replace').strip()
+            if not line or line.startswith(EXPORT_HEADER_PREFIXES):
+                continue
+            if fmt == 'csv':
+                fields = next(csv.reader([line]), [])
+                account = fields[index].strip() if index < len(fields) else ''
+            elif split_fields:
+                account = line.split(FIELD_SEPARATOR, 1)[0].strip()
+            else:
+                account = line
+            if account and len(account) <= 255:
+                yield position, account
+
+
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ----------------------------
+# 检查点
+# ----------------------------
+def checkpoint_path(path):
+    return f"{path}.import-checkpoint.json"
+
+
+def load_checkpoint(path, pool_name, split_fields):
+    """读取与当前文件、账号池、拆分方式匹配的检查点；文件被修改过时忽略"""
+    try:
+        with open(checkpoint_path(path), encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(path)
+    if (checkpoint.get("pool") != pool_name or checkpoint.get("size") != stat.st_size
+            or checkpoint.get("mtime") != int(stat.st_mtime)
+            or checkpoint.get("split_fields", False) != split_fields):
+        print("⚠️ 文件、账号池或拆分方式与检查点不一致，从头导入")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    # 先写临时文件再替换，中断时不会留下写了一半的检查点
+    target = checkpoint_path(path)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target)), suffix=".tmp")
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, target)
+
+
+# ----------------------------
+# 入库
+# ----------------------------
+def _escape_load_data(value):
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def load_data_chunk(session, accounts):
+    """MySQL: 写临时文件后 LOAD DATA LOCAL INFILE ... IGNORE，返回实际插入的行数"""
+    hashes = [account_digest(acc) for acc in accounts]
+    fd, tmp = tempfile.mkstemp(suffix=".tsv")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as f:
+            for acc, digest in zip(accounts, hashes):
+                f.write(f"{_escape_load_data(acc)}\t{digest.hex()}\n")
+        inserted = session.execute(text(
+            "LOAD DATA LOCAL INFILE :path IGNORE INTO TABLE accounts CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' (account, @hash) "
+            "SET account_hash = UNHEX(@hash), status = 'unused', "
+            "created_at = UTC_TIMESTAMP(), updated_at = UTC_TIMESTAMP(6)"
+        ), {"path": tmp}).rowcount
+    finally:
+        os.remove(tmp)
+    if not inserted:
+        return 0
+    return inserted - drop_archived_duplicates(session, hashes)
+
+
+class Importer:
+    def __init__(self, pool, method):
+        self.pool = pool
+        dialect = pool.get_engine().dialect.name
+        if method == 'auto':
+            method = 'load-data' if dialect in ('mysql', 'mariadb') else 'insert'
+        if method == 'load-data':
+            if dialect not in ('mysql', 'mariadb'):
+                raise SystemExit("--method load-data 只支持 MySQL")
+            # LOAD DATA LOCAL 需要在连接时开启 local_infile
+            self.engine = create_engine(pool.url, pool_pre_ping=True, connect_args={"local_infile": True})
+        else:
+            self.engine = pool.get_engine()
+        self.method = method
+
+    def import_chunk(self, accounts):
+        """导入一块（块内先去重），与统计计数器在同一个事务里提交，返回新增的账号数"""
+        accounts = list(dict.fromkeys(accounts))
+        with Session(bind=self.engine) as session:
+            try:
+                if self.method == 'load-data':
+                    try:
+                        inserted = load_data_chunk(session, accounts)
+                    except OperationalError as e:
+                        # 服务器没有开启 local_infile 等：改用多行 INSERT IGNORE
+                        session.rollback()
+                        print(f"\n⚠️ LOAD DATA 不可用（{e.orig}），改用多行 INSERT")
+                        self.method = 'insert'
+                        self.engine = self.pool.get_engine()
+                        return self.import_chunk(accounts)
+                else:
+                    inserted = insert_accounts_chunk(session, accounts)
+                bump_counters(session, total=inserted)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+        return inserted
+
+
+def run_import(args):
+    pool = POOLS[args.pool]
+    fmt = args.format
+    if fmt == 'auto':
+        fmt = 'csv' if args.path.lower().endswith('.csv') else 'text'
+
+    checkpoint = None if args.restart else load_checkpoint(args.path, pool.name, args.split_fields)
+    if checkpoint:
+        print(f"从检查点继续：已处理 {checkpoint['received']} 行，新增 {checkpoint['added']} 个")
+    else:
+        stat = os.stat(args.path)
+        checkpoint = {"pool": pool.name, "size": stat.st_size, "mtime": int(stat.st_mtime),
+                      "split_fields": args.split_fields, "offset": 0, "received": 0, "added": 0}
+
+    importer = Importer(pool, args.method)
+    size = checkpoint["size"] or 1
+    start = time.perf_counter()
+    received = 0
+    rows = iter_file_accounts(args.path, fmt, args.column, args.split_fields, checkpoint["offset"])
+    for chunk in iter_chunks(rows, args.chunk_size):
+        added = importer.import_chunk([account for _, account in chunk])
+        received += len(chunk)
+        checkpoint.update(
+            offset=chunk[-1][0],
+            received=checkpoint["received"] + len(chunk),
+            added=checkpoint["added"] + added
+        )
+        save_checkpoint(args.path, checkpoint)
+
+        elapsed = time.perf_counter() - start
+        print(f"\r已处理 {checkpoint['received']} 行（{checkpoint['offset'] * 100 / size:.1f}%），"
+              f"新增 {checkpoint['added']} 个，{received / max(elapsed, 1e-6):.0f} 行/秒", end="", flush=True)
+
+    print()
+    if os.path.exists(checkpoint_path(args.path)):
+        os.remove(checkpoint_path(args.path))
+    print(f"导入完成：共处理 {checkpoint['received']} 行，新增 {checkpoint['added']} 个，"
+          f"跳过 {checkpoint['received'] - checkpoint['added']} 个重复 / 已存在的账号"
+          f"（{importer.method}，耗时 {time.perf_counter() - start:.1f} 秒）")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="从文件批量导入账号")
+    parser.add_argument("path", help="账号文件（文本或 CSV）")
+    parser.add_argument("--pool", default=DEFAULT_POOL, help=f"账号池（默认 {DEFAULT_POOL}）")
+    parser.add_argument("--format", choices=["auto", "text", "csv"], default="auto",
+                        help="文件格式，默认按扩展名判断")
+    parser.add_argument("--column", help="CSV 中账号所在的列名（默认 account 列，没有该列时取第一列）")
+    parser.add_argument("--split-fields", action="store_true",
+                        help="文本文件只取 ---- 前的第一段作为账号（默认整行；与库里的整行账号不会去重）")
+    parser.add_argument("--method", choices=["auto", "load-data", "insert"], default="auto",
+                        help="入库方式，默认 MySQL 用 LOAD DATA，其它用多行 INSERT")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help="每个事务导入的账号数")
+    parser.add_argument("--restart", action="store_true", help="忽略检查点，从头导入")
+    args = parser.parse_args()
+    if args.pool not in POOLS:
+        parser.error(f"未知的账号池: {args.pool}（可用: {', '.join(POOLS)}）")
+    if not os.path.isfile(args.path):
+        parser.error(f"文件不存在: {args.path}")
+    return args
+
+
+if __name__ == '__main__':
+    try:
+        run_import(parse_args())
+    except KeyboardInterrupt:
+        sys.exit("\n已中断，重新执行同一命令会从检查点继续")
@@ -0,0 +1,138 @@
+"""
+Prometheus 指标（/metrics）
+
+多 worker 部署时设置环境变量 PROMETHEUS_MULTIPROC_DIR（一个空目录），各 worker 把指标写到
+该目录下的 mmap 文件里，/metrics 由 MultiProcessCollector 汇总所有 worker 的数据；
+gunicorn 需要用 gunicorn.conf.py 启动，在 worker 退出时清理它的文件。
+
+没有安装 prometheus_client 时所有指标都是空操作，/metrics 返回 501。
+"""
+import os
+import time
+
+from sqlalchemy import event
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+    )
+    from prometheus_client import multiprocess
+except ImportError:
+    multiprocess = None
+    ENABLED = False
+else:
+    ENABLED = True
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+if ENABLED:
+    REQUEST_LATENCY = Histogram(
+        'vmq_request_latency_seconds', '接口耗时', ['route', 'method', 'status'],
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    )
+    REQUESTS_IN_PROGRESS = Gauge(
+        'vmq_requests_in_progress', '正在处理的请求数', ['route'], multiprocess_mode='livesum'
+    )
+    ACCOUNTS_ADDED = Counter('vmq_accounts_added_total', '新增入库的账号数')
+    ACCOUNTS_EXTRACTED = Counter('vmq_accounts_extracted_total', '提取出去的账号数')
+    EXTRACT_REPLAYS = Counter('vmq_extract_replays_total', '按请求 id 重放的 /extract 次数')
+    EXTRACT_LOCK_WAIT = Histogram(
+        'vmq_extract_lock_wait_seconds', '提取时认领（加锁）语句的耗时',
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    )
+    EXTRACT_QUEUE_DEPTH = Gauge(
+        'vmq_extract_queue_depth', '排队等待认领名额的批次数', ['pool'], multiprocess_mode='livesum'
+    )
+    EXTRACT_ACTIVE = Gauge(
+        'vmq_extract_active', '正在执行的认领批次数', ['pool'], multiprocess_mode='livesum'
+    )
+    EXTRACT_QUEUE_WAIT = Histogram(
+        'vmq_extract_queue_wait_seconds', '认领批次排队等待名额的时间', ['pool'],
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    )
+    EXTRACT_REJECTED = Counter(
+        'vmq_extract_rejected_total', '被调度拒绝的 /extract 请求数（quota: 超出配额，queue: 队列已满或排队超时）',
+        ['pool', 'reason']
+    )
+    REPLICA_LAG = Gauge(
+        'vmq_db_replica_lag_seconds', '只读副本落后主库的秒数（-1 表示不可用）', ['pool'], multiprocess_mode='max'
+    )
+    POOL_CHECKED_OUT = Gauge(
+        'vmq_db_pool_checked_out', '已借出的数据库连接数', ['pool'], multiprocess_mode='livesum'
+    )
+    POOL_OVERFLOW = Gauge(
+        'vmq_db_pool_overflow', '超出 pool_size 的溢出连接数', ['pool'], multiprocess_mode='livesum'
+    )
+    POOL_CHECKOUTS = Counter('vmq_db_pool_checkouts_total', '连接借出次数', ['pool'])
+    POOL_CHECKOUT_WAIT = Histogram(
+        'vmq_db_pool_checkout_wait_seconds', '从连接池取连接的等待时间', ['pool'],
+        buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+    )
+else:
+    REQUEST_LATENCY = REQUESTS_IN_PROGRESS = ACCOUNTS_ADDED = ACCOUNTS_EXTRACTED = EXTRACT_REPLAYS = _NoopMetric()
+    EXTRACT_QUEUE_DEPTH = EXTRACT_ACTIVE = EXTRACT_QUEUE_WAIT = EXTRACT_REJECTED = _NoopMetric()
+    EXTRACT_LOCK_WAIT = REPLICA_LAG = POOL_CHECKED_OUT = POOL_OVERFLOW = POOL_CHECKOUTS = POOL_CHECKOUT_WAIT = _NoopMetric()
+
+
+def instrument_engine(engine, pool_name):
+    """记录连接池借出 / 归还、溢出连接数，以及取连接的等待时间（按账号池区分）"""
+    if not ENABLED:
+        return
+    pool = engine.pool
+    checked_out = POOL_CHECKED_OUT.labels(pool_name)
+    overflow = POOL_OVERFLOW.labels(pool_name)
+    checkouts = POOL_CHECKOUTS.labels(pool_name)
+    checkout_wait = POOL_CHECKOUT_WAIT.labels(pool_name)
+
+    @event.listens_for(pool, 'checkout')
+    def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+        checked_out.inc()
+        checkouts.inc()
+        if hasattr(pool, 'overflow'):
+            overflow.set(max(pool.overflow(), 0))
+
+    @event.listens_for(pool, 'checkin')
+    def _on_checkin(dbapi_conn, conn_record):
+        checked_out.dec()
+        if hasattr(pool, 'overflow'):
+            overflow.set(max(pool.overflow(), 0))
+
+    # 连接池没有“开始等待”的事件，直接包一层取连接的方法计时
+    do_get = pool._do_get
+
+    def timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            checkout_wait.observe(time.perf_counter() - start)
+
+    pool._do_get = timed_do_get
+
+
+def render():
+    """返回 (响应内容, Content-Type)，多进程模式下汇总所有 worker"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
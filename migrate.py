@@ -0,0 +1,193 @@
+"""
+数据库初始化 / 结构升级脚本（建表，并对已存在的库补齐新增的列、索引等）
+
+服务器启动时不再自动建表，部署新代码后、重启 gunicorn 前先执行一次。
+
+与 app.py 使用同样的账号池配置（pools.json 或 DB_* 环境变量），例如:
+    python migrate.py                 # 所有账号池
+    python migrate.py vmq bianfu      # 指定账号池
+
+设置 ACCOUNT_HASH_UNIQUE=1 时，会在 account_hash 唯一索引建好后删除 account 列上的唯一索引，
+之后唯一性只由 16 字节的 account_hash 保证（服务器也要用同样的环境变量启动）。删除之前会再回填一次
+迁移期间旧服务器写入的行，并把 account_hash 改为 NOT NULL。
+
+每一步都会先检查当前结构，重复执行是安全的。
+"""
+import sys
+
+from sqlalchemy import bindparam, func, inspect, select, text, update
+from sqlalchemy.exc import OperationalError
+
+from app import POOLS, Base, reconcile_counters, Account, AccountArchive, IngestJob, ACCOUNT_HASH_UNIQUE, account_digest
+
+# 回填 account_hash 时每批处理的行数
+BACKFILL_BATCH_SIZE = 5000
+
+
+def create_tables(engine):
+    """创建缺少的表"""
+    Base.metadata.create_all(bind=engine)
+
+
+def add_missing_columns(engine):
+    """添加模型中声明但库里还没有的列（新增列都允许为空）"""
+    for model in (Account, IngestJob):
+        existing = {col['name'] for col in inspect(engine).get_columns(model.__tablename__)}
+        with engine.begin() as conn:
+            for column in model.__table__.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                print(f"添加列 {model.__tablename__}.{column.name} {col_type} ...")
+                conn.execute(text(f"ALTER TABLE {model.__tablename__} ADD COLUMN {column.name} {col_type} NULL"))
+
+
+def sync_status_enum(engine):
+    """
+    MySQL 的 status 是原生 ENUM，新增取值（如 'reserved'）需要 MODIFY COLUMN。
+    新取值只追加在末尾，已有取值的编号不变，可以 ALGORITHM=INSTANT（不支持时 INPLACE）就地修改，不复制整张表。
+    """
+    if engine.dialect.name not in ('mysql', 'mariadb'):
+        return
+    for model in (Account, AccountArchive):
+        _sync_status_enum(engine, model)
+
+
+def _sync_status_enum(engine, model):
+    column = model.__table__.c.status
+    current = next(col for col in inspect(engine).get_columns(model.__tablename__) if col['name'] == 'status')
+    current_enums = list(getattr(current['type'], 'enums', []))
+    target_enums = list(column.type.enums)
+    if current_enums == target_enums:
+        return
+    col_type = column.type.compile(dialect=engine.dialect)
+    sql = f"ALTER TABLE {model.__tablename__} MODIFY COLUMN status {col_type}"
+    if target_enums[:len(current_enums)] != current_enums:
+        # 已有取值的顺序变了（例如早先把 'reserved' 插在了中间）：只能复制整张表，会长时间锁表
+        print(f"⚠️ 修改 {model.__tablename__}.status 为 {col_type}：已有取值顺序变化，MySQL 需要复制整张表 ...")
+        with engine.begin() as conn:
+            conn.execute(text(sql))
+        return
+
+    print(f"修改 {model.__tablename__}.status 为 {col_type} ...")
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"{sql}, ALGORITHM=INSTANT"))
+    except OperationalError:
+        # 旧版本 MySQL / MariaDB 不支持 INSTANT
+        with engine.begin() as conn:
+            conn.execute(text(f"{sql}, ALGORITHM=INPLACE, LOCK=NONE"))
+
+
+def backfill_account_hash(engine):
+    """按 id 分批为旧数据补上 account_hash，每批一个短事务"""
+    table = Account.__table__
+    last_id = 0
+    filled = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.account)
+                .where(table.c.id > last_id, table.c.account_hash.is_(None))
+                .order_by(table.c.id).limit(BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            conn.execute(
+                update(table).where(table.c.id == bindparam('row_id'))
+                .values(account_hash=bindparam('digest'), updated_at=table.c.updated_at),
+                [{"row_id": row.id, "digest": account_digest(row.account)} for row in rows]
+            )
+        last_id = rows[-1].id
+        filled += len(rows)
+        print(f"回填 account_hash: {filled} 行")
+
+
+def backfill_updated_at(engine):
+    """旧数据的 updated_at 取提取时间或创建时间，按 id 分批更新"""
+    table = Account.__table__
+    last_id = 0
+    filled = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(
+                select(table.c.id)
+                .where(table.c.id > last_id, table.c.updated_at.is_(None))
+                .order_by(table.c.id).limit(BACKFILL_BATCH_SIZE)
+            ).scalars().all()
+            if not ids:
+                break
+            conn.execute(
+                update(table).where(table.c.id.in_(ids))
+                .values(updated_at=func.coalesce(table.c.extracted_at, table.c.created_at))
+            )
+        last_id = ids[-1]
+        filled += len(ids)
+        print(f"回填 updated_at: {filled} 行")
+
+
+def drop_account_unique(engine):
+    """ACCOUNT_HASH_UNIQUE=1 时删除 account 列上的唯一索引，唯一性交给 account_hash"""
+    if not ACCOUNT_HASH_UNIQUE:
+        return
+    inspector = inspect(engine)
+    indexes = {ix['name'] for ix in inspector.get_indexes(Account.__tablename__)}
+    if 'ux_accounts_account_hash' not in indexes:
+        print("account_hash 唯一索引不存在，跳过删除 account 唯一索引")
+        return
+    for ix in inspector.get_indexes(Account.__tablename__):
+        if ix['unique'] and ix['column_names'] == ['account']:
+            if engine.dialect.name == 'sqlite':
+                print("SQLite 不支持删除建表时的唯一约束，跳过")
+                return
+            # 回填之后旧服务器（不写 account_hash）插入的行：再补一次，然后禁止空值。
+            # 此后还有旧服务器在写入时它们的插入会失败，而不是写入不受唯一索引约束的空摘要
+            backfill_account_hash(engine)
+            print("account_hash 改为 NOT NULL ...")
+            col_type = Account.__table__.c.account_hash.type.compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {Account.__tablename__} MODIFY COLUMN account_hash {col_type} NOT NULL"))
+            print(f"删除 account 唯一索引 {ix['name']} ...")
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {Account.__tablename__} DROP INDEX {ix['name']}"))
+
+
+def add_missing_indexes(engine):
+    """创建模型中声明但库里还没有的索引（accounts 和 accounts_archive）"""
+    for model in (Account, AccountArchive):
+        existing = {ix['name'] for ix in inspect(engine).get_indexes(model.__tablename__)}
+        for index in model.__table__.indexes:
+            if index.name in existing:
+                continue
+            print(f"创建索引 {index.name} ...")
+            index.create(bind=engine)
+
+
+# 按顺序执行的升级步骤
+MIGRATIONS = [
+    create_tables,
+    add_missing_columns,
+    sync_status_enum,
+    backfill_account_hash,
+    backfill_updated_at,
+    add_missing_indexes,
+    drop_account_unique,
+]
+
+
+def upgrade(pool):
+    engine = pool.get_engine()
+    for step in MIGRATIONS:
+        step(engine)
+    # 初始化 / 校正 /stats 使用的计数器
+    reconcile_counters(pool)
+    print(f"账号池 {pool.name}（数据库 {engine.url.database}）升级完成")
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(POOLS)
+    unknown = [name for name in names if name not in POOLS]
+    if unknown:
+        sys.exit(f"未知的账号池: {', '.join(unknown)}（可用: {', '.join(POOLS)}）")
+    for name in names:
+        upgrade(POOLS[name])
@@ -0,0 +1,237 @@
+"""
+账号池配置与数据库连接管理
+
+一个服务器进程可以托管多个账号池，每个池对应一个独立的数据库（例如 vmq、bianfu），
+接口路径为 /pools/<name>/...，不带前缀的旧路径访问默认池。
+
+配置文件由环境变量 POOLS_CONFIG 指定（默认是 app.py 同级的 pools.json），格式见 pools.example.json:
+    {
+        "default": "vmq",
+        "pools": {
+            "vmq": {"database": "vmq"},
+            "bianfu": {"database": "bianfu", "password": "123456", "pool_size": 2}
+        }
+    }
+每个池可以直接写 "url"，或者写 host / port / user / password / database，缺省值取 DB_* 环境变量；
+pool_size / max_overflow / pool_timeout / pool_recycle / pre_ping / idle_timeout 缺省取 DB_POOL_* 环境变量。
+没有配置文件时只有一个池，完全由 DB_* / DATABASE_URL 环境变量决定（与原来的单库部署一致）。
+
+只读副本（可选）：池配置里写 "replica_url"，或 "replica": {"host": ...}（没写的字段与主库相同）；
+单池部署用 DB_REPLICA_HOST / DB_REPLICA_PORT / DB_REPLICA_USER / DB_REPLICA_PASSWORD 或 DATABASE_REPLICA_URL。
+/stats、/export、/accounts、/changes 读副本，写入和认领始终在主库（见 app.py 的 read_session）。
+副本延迟由 app.py 的后台线程检查，连接副本的超时为 DB_REPLICA_CONNECT_TIMEOUT 秒（MySQL）。
+"""
+from pathlib import Path
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import metrics
+import profiling
+
+# ----------------------------
+# 默认数据库连接配置
+# ----------------------------
+DB_USER = os.getenv("DB_USER", "root")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "w1402848990W")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "3306")
+DB_NAME = os.getenv("DB_NAME", "vmq")
+
+# 连接池配置（每个 worker 进程、每个账号池各自一个连接池）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))      # 秒，取不到连接时的最长等待
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))    # 秒，连接最长复用时间（要小于 MySQL wait_timeout）
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"   # 借出连接前先 ping，丢弃已断开的连接
+DB_POOL_IDLE_TIMEOUT = int(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))  # 秒，池空闲超过该时间就关闭它的连接
+
+# 只读副本（不设置 DB_REPLICA_HOST 时不启用）
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST")
+DB_REPLICA_PORT = os.getenv("DB_REPLICA_PORT", DB_PORT)
+DB_REPLICA_USER = os.getenv("DB_REPLICA_USER", DB_USER)
+DB_REPLICA_PASSWORD = os.getenv("DB_REPLICA_PASSWORD", DB_PASSWORD)
+DB_REPLICA_CONNECT_TIMEOUT = int(os.getenv("DB_REPLICA_CONNECT_TIMEOUT", "2"))  # 秒，连接副本的超时（副本宕机时尽快改读主库）
+
+POOLS_CONFIG = os.getenv("POOLS_CONFIG", str(Path(__file__).parent / "pools.json"))
+
+_Session = sessionmaker()
+
+
+def mysql_url(user, password, host, port, database):
+    return f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}?charset=utf8mb4"
+
+
+class AccountPool:
+    """一个账号池：数据库地址 + 本进程内按需创建的引擎"""
+
+    def __init__(self, name, url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                 pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE, pre_ping=DB_POOL_PRE_PING,
+                 idle_timeout=DB_POOL_IDLE_TIMEOUT, replica_url=None):
+        self.name = name
+        self.url = url
+        self.replica_url = replica_url
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_recycle = pool_recycle
+        self.pre_ping = pre_ping
+        self.idle_timeout = idle_timeout
+
+        # 本进程内的写请求提交后通知挂起的 /stats/watch
+        self.stats_changed = threading.Condition()
+        # 预认领缓冲区、/extract 调度队列（由 app.py 按需创建）
+        self.extract_buffer = None
+        self.extract_scheduler = None
+
+        # 副本状态（由 app.py 的后台线程定期检查心跳后更新）：是否可用、副本已同步到的主库时间、
+        # 上次检查时间、连续连不上的次数，以及最近一次只读请求的时间
+        self.replica_usable = False
+        self.replica_synced_at = None
+        self.replica_checked_at = None
+        self.replica_failures = 0
+        self.replica_read_at = None
+
+        self._engine = None
+        self._engine_pid = None
+        self._replica_engine = None
+        self._lock = threading.Lock()
+        self._last_used = time.monotonic()
+
+    def _create_engine(self, url, label, connect_args=None):
+        options = {"echo": False, "pool_pre_ping": self.pre_ping, "pool_recycle": self.pool_recycle}
+        if not url.startswith("sqlite"):
+            options.update(pool_size=self.pool_size, max_overflow=self.max_overflow,
+                           pool_timeout=self.pool_timeout)
+        if connect_args:
+            options["connect_args"] = connect_args
+        engine = create_engine(url, **options)
+        metrics.instrument_engine(engine, label)
+        profiling.instrument_engine(engine, label)
+        return engine
+
+    def get_engine(self):
+        """
+        引擎在每个进程第一次用到时才创建：导入模块 / gunicorn fork worker 时不访问数据库，
+        fork 之后子进程也不会复用父进程的连接
+        """
+        self._last_used = time.monotonic()
+        engine = self._engine
+        if engine is not None and self._engine_pid == os.getpid():
+            return engine
+        with self._lock:
+            if self._engine is None or self._engine_pid != os.getpid():
+                self._engine = self._create_engine(self.url, self.name)
+                self._replica_engine = None
+                self.replica_usable = False
+                self.replica_checked_at = None
+                self.replica_failures = 0
+                self._engine_pid = os.getpid()
+            return self._engine
+
+    def get_replica_engine(self):
+        """只读副本的引擎（与主库引擎同样按进程延迟创建），没有配置副本时返回 None"""
+        if not self.replica_url:
+            return None
+        self.get_engine()
+        with self._lock:
+            if self._replica_engine is None:
+                connect_args = None
+                if self.replica_url.startswith(("mysql", "mariadb")):
+                    connect_args = {"connect_timeout": DB_REPLICA_CONNECT_TIMEOUT}
+                self._replica_engine = self._create_engine(self.replica_url, f"{self.name}:replica", connect_args)
+            return self._replica_engine
+
+    def session(self):
+        """新建一个绑定到本池引擎的 Session"""
+        return _Session(bind=self.get_engine())
+
+    def replica_session(self):
+        """新建一个绑定到只读副本的 Session（session.info['replica'] 为 True）"""
+        session = _Session(bind=self.get_replica_engine())
+        session.info['replica'] = True
+        return session
+
+    def is_active(self):
+        """本进程是否已经连接过这个池"""
+        return self._engine is not None and self._engine_pid == os.getpid()
+
+    def notify_stats_changed(self):
+        with self.stats_changed:
+            self.stats_changed.notify_all()
+
+    def release_if_idle(self):
+        """空闲超过 idle_timeout 且没有借出的连接时，关闭这个池的全部连接（下次使用时重新创建引擎）"""
+        if self.idle_timeout <= 0 or not self.is_active():
+            return False
+        if time.monotonic() - self._last_used < self.idle_timeout:
+            return False
+        with self._lock:
+            engines = [e for e in (self._engine, self._replica_engine) if e is not None]
+            if not engines or any(getattr(e.pool, 'checkedout', lambda: 0)() > 0 for e in engines):
+                return False
+            self._engine = None
+            self._engine_pid = None
+            self._replica_engine = None
+            self.replica_usable = False
+            self.replica_checked_at = None
+            self.replica_failures = 0
+        for engine in engines:
+            engine.dispose()
+        return True
+
+
+def _pool_from_config(name, conf):
+    url = conf.get("url") or mysql_url(
+        conf.get("user", DB_USER),
+        conf.get("password", DB_PASSWORD),
+        conf.get("host", DB_HOST),
+        conf.get("port", DB_PORT),
+        conf.get("database", name)
+    )
+    replica_url = conf.get("replica_url")
+    if not replica_url and conf.get("replica"):
+        # 副本没写的字段与主库相同
+        replica = dict(conf, **conf["replica"])
+        replica_url = mysql_url(
+            replica.get("user", DB_USER),
+            replica.get("password", DB_PASSWORD),
+            replica.get("host", DB_HOST),
+            replica.get("port", DB_PORT),
+            replica.get("database", name)
+        )
+    return AccountPool(
+        name, url,
+        pool_size=int(conf.get("pool_size", DB_POOL_SIZE)),
+        max_overflow=int(conf.get("max_overflow", DB_MAX_OVERFLOW)),
+        pool_timeout=int(conf.get("pool_timeout", DB_POOL_TIMEOUT)),
+        pool_recycle=int(conf.get("pool_recycle", DB_POOL_RECYCLE)),
+        pre_ping=bool(conf.get("pre_ping", DB_POOL_PRE_PING)),
+        idle_timeout=int(conf.get("idle_timeout", DB_POOL_IDLE_TIMEOUT)),
+        replica_url=replica_url
+    )
+
+
+def load_pools(path=POOLS_CONFIG):
+    """读取账号池配置，返回 ({名称: AccountPool}, 默认池名称)"""
+    if not os.path.exists(path):
+        # 没有配置文件：单个池，可用 DATABASE_URL 直接覆盖（例如本地测试用 sqlite:///test.db）
+        url = os.getenv("DATABASE_URL", mysql_url(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME))
+        replica_url = os.getenv("DATABASE_REPLICA_URL")
+        if not replica_url and DB_REPLICA_HOST:
+            replica_url = mysql_url(DB_REPLICA_USER, DB_REPLICA_PASSWORD, DB_REPLICA_HOST, DB_REPLICA_PORT, DB_NAME)
+        return {DB_NAME: AccountPool(DB_NAME, url, replica_url=replica_url)}, DB_NAME
+
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    pools = {name: _pool_from_config(name, conf or {}) for name, conf in config["pools"].items()}
+    if not pools:
+        raise ValueError(f"{path} 中没有配置任何账号池")
+    default = config.get("default") or next(iter(pools))
+    if default not in pools:
+        raise ValueError(f"默认账号池 {default} 不在 {path} 的 pools 中")
+    return pools, default
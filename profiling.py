@@ -0,0 +1,283 @@
+"""
+慢查询日志与按需请求剖析
+
+慢查询：每个引擎挂 before/after_cursor_execute 事件计时，超过 SLOW_QUERY_MS 的语句（包括执行出错的，
+例如锁等待超时）按一行 JSON 写到 SLOW_QUERY_LOG（不设置时写到 stderr，即 gunicorn 的 error log）。
+只记录语句和参数个数，不记录参数值（里面是账号）。
+
+请求剖析：请求头带 X-Profile: 1，或按 PROFILE_SAMPLE_RATE 抽样的请求，记录各阶段耗时：
+    compile    SQL 编译、绑定参数（几千行的多行 VALUES 编译起来比执行还慢）
+    db         游标执行 SQL 的时间（包括等锁）
+    orm        SQL 返回之后构造 ORM 对象的时间
+    serialize  JSON 编码 / 解码
+    other      其余（业务逻辑、等待认领队列等）
+以及 SQL 条数和最慢的几条语句。只保留最慢的 PROFILE_KEEP 个，每个一个 JSON 文件，
+文件名以耗时开头（ls 即按耗时排序），放在 PROFILE_DIR；多个 worker 共用这个目录。
+用请求头开启时响应里带 Server-Timing 头，浏览器开发者工具 / curl -v 可以直接看到。
+"""
+from contextlib import contextmanager
+from datetime import datetime
+import contextvars
+import heapq
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Mapper
+
+# ----------------------------
+# 配置
+# ----------------------------
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))                # 毫秒，0 表示不记录慢查询
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "")                        # 慢查询日志文件，为空时写到 stderr
+SLOW_QUERY_MAX_STATEMENT = int(os.getenv("SLOW_QUERY_MAX_STATEMENT", "2000"))  # 日志里 SQL 最多保留的字符数
+PROFILE_HEADER = "X-Profile"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))      # 0~1，按比例抽样剖析，0 表示只剖析带请求头的
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/vmq-profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))                     # 保留最慢的几个请求
+PROFILE_TOP_QUERIES = 5                                                 # 每个请求记录最慢的几条 SQL
+
+_current = contextvars.ContextVar("vmq_request_profile", default=None)
+_route = contextvars.ContextVar("vmq_request_route", default=None)
+
+_slow_log = logging.getLogger("vmq.slow_query")
+_slow_log.propagate = False
+_slow_log.setLevel(logging.INFO)
+if SLOW_QUERY_MS > 0:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG, encoding="utf-8") if SLOW_QUERY_LOG else logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    _slow_log.addHandler(_handler)
+
+
+def _compact(statement):
+    statement = " ".join(statement.split())
+    if len(statement) > SLOW_QUERY_MAX_STATEMENT:
+        statement = statement[:SLOW_QUERY_MAX_STATEMENT] + " ..."
+    return statement
+
+
+# ----------------------------
+# 请求剖析
+# ----------------------------
+class RequestProfile:
+    def __init__(self, route, method, reason):
+        self.route = route
+        self.method = method
+        self.reason = reason
+        self.status = None
+        self.started_at = datetime.utcnow()
+        self.start = time.perf_counter()
+        self.phases = {"compile": 0.0, "db": 0.0, "orm": 0.0, "serialize": 0.0}
+        self.queries = 0
+        self.slowest = []  # 小顶堆 (耗时, 序号, 语句)
+        self.orm_mark = None
+
+    def add_query(self, elapsed, statement):
+        self.queries += 1
+        self.phases["db"] += elapsed
+        item = (elapsed, self.queries, statement)
+        if len(self.slowest) < PROFILE_TOP_QUERIES:
+            heapq.heappush(self.slowest, item)
+        elif elapsed > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, item)
+        # 之后到下一条 SQL 之前的 ORM 对象构造都算在 orm 里
+        self.orm_mark = time.perf_counter()
+
+    def server_timing(self):
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self, total):
+        phases = {f"{name}_ms": round(seconds * 1000, 2) for name, seconds in self.phases.items()}
+        phases["other_ms"] = round(max(total - sum(self.phases.values()), 0) * 1000, 2)
+        return {
+            "ts": self.started_at.isoformat(),
+            "pid": os.getpid(),
+            "route": self.route,
+            "method": self.method,
+            "status": self.status,
+            "reason": self.reason,
+            "total_ms": round(total * 1000, 2),
+            "phases": phases,
+            "queries": self.queries,
+            "slowest_queries": [
+                {"ms": round(elapsed * 1000, 2), "statement": _compact(statement)}
+                for elapsed, _, statement in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+
+def start_request(route, method, header_value=None):
+    """请求开始时调用（header_value 是 X-Profile 请求头），返回值交给 server_timing / finish_request"""
+    reason = None
+    if header_value and header_value not in ("0", "false"):
+        reason = "header"
+    elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        reason = "sample"
+    profile = RequestProfile(route, method, reason) if reason else None
+    _route.set(route)
+    _current.set(profile)
+    return profile
+
+
+def server_timing(profile):
+    """用请求头开启剖析时返回 Server-Timing 响应头的值（到目前为止的耗时），否则返回 None"""
+    if profile is None or profile.reason != "header":
+        return None
+    return profile.server_timing()
+
+
+def finish_request(profile, status):
+    """请求结束时调用（流式响应在输出结束之后），剖析结果进入最慢的 N 个时写入 PROFILE_DIR"""
+    # 流式响应可能在另一个线程里结束，直接清空而不是 reset
+    detach()
+    if profile is None:
+        return
+    profile.status = status
+    try:
+        _keep_if_slow(profile.to_dict(time.perf_counter() - profile.start))
+    except OSError as e:
+        print(f"⚠️ 写入请求剖析结果失败: {e}")
+
+
+def detach():
+    """当前上下文不再属于任何请求（asgi.py 的后台任务会复制创建它的请求的上下文）"""
+    _route.set(None)
+    _current.set(None)
+
+
+@contextmanager
+def phase(name):
+    """把 with 块的耗时计入当前请求的 name 阶段（当前请求没有开启剖析时什么也不做）"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.phases[name] += time.perf_counter() - start
+        # 这段时间不算 ORM 对象构造
+        if profile.orm_mark is not None:
+            profile.orm_mark = time.perf_counter()
+
+
+_keep_lock = threading.Lock()
+_kept = None  # 小顶堆 (耗时毫秒, 文件路径)，第一次使用时从 PROFILE_DIR 读取（其他 worker / 上次运行留下的）
+
+
+def _scan_kept():
+    kept = []
+    for name in os.listdir(PROFILE_DIR):
+        try:
+            total_ms = float(name.split("ms-", 1)[0])
+        except ValueError:
+            continue
+        kept.append((total_ms, os.path.join(PROFILE_DIR, name)))
+    heapq.heapify(kept)
+    return kept
+
+
+def _keep_if_slow(record):
+    global _kept
+    with _keep_lock:
+        if _kept is None:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            _kept = _scan_kept()
+        total_ms = record["total_ms"]
+        if len(_kept) >= PROFILE_KEEP and total_ms <= _kept[0][0]:
+            return
+        route = re.sub(r"[^0-9A-Za-z]+", "_", record["route"] or "").strip("_") or "root"
+        path = os.path.join(PROFILE_DIR, f"{total_ms:012.2f}ms-{route}-{record['pid']}-{time.time_ns()}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        heapq.heappush(_kept, (total_ms, path))
+        while len(_kept) > PROFILE_KEEP:
+            _, evicted = heapq.heappop(_kept)
+            try:
+                os.remove(evicted)
+            except FileNotFoundError:
+                # 其他 worker 已经删掉了
+                pass
+
+
+# ----------------------------
+# 引擎钩子
+# ----------------------------
+def _log_slow_query(elapsed, label, statement, parameters, executemany, error=None):
+    params = len(parameters) if isinstance(parameters, (list, tuple, dict)) else 0
+    record = {
+        "ts": datetime.utcnow().isoformat(),
+        "pid": os.getpid(),
+        "pool": label,
+        "route": _route.get(),
+        "ms": round(elapsed * 1000, 2),
+        "statement": _compact(statement),
+        "params": params,
+        "executemany": executemany,
+    }
+    if error is not None:
+        record["error"] = f"{type(error).__name__}: {error}"
+    _slow_log.info(json.dumps(record, ensure_ascii=False))
+
+
+def instrument_engine(engine, label):
+    """SQL 计时：慢查询日志 + 计入当前请求的 compile / db 阶段"""
+
+    @event.listens_for(engine, "before_execute")
+    def _before_compile(conn, clauseelement, multiparams, params, execution_options):
+        if _current.get() is not None:
+            conn.info["vmq_compile_start"] = time.perf_counter()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        now = time.perf_counter()
+        compile_start = conn.info.pop("vmq_compile_start", None)
+        profile = _current.get()
+        if compile_start is not None and profile is not None:
+            profile.phases["compile"] += now - compile_start
+        conn.info.setdefault("vmq_query_start", []).append(now)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["vmq_query_start"].pop()
+        profile = _current.get()
+        if profile is not None:
+            profile.add_query(elapsed, statement)
+        if 0 < SLOW_QUERY_MS <= elapsed * 1000:
+            _log_slow_query(elapsed, label, statement, parameters, executemany)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        # 执行出错（锁等待超时、死锁等）时没有 after_cursor_execute，在这里计时
+        conn = context.connection
+        starts = conn.info.get("vmq_query_start") if conn is not None else None
+        if not starts or context.statement is None:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        profile = _current.get()
+        if profile is not None:
+            profile.add_query(elapsed, context.statement)
+        if 0 < SLOW_QUERY_MS <= elapsed * 1000:
+            _log_slow_query(elapsed, label, context.statement, context.parameters,
+                            context.execution_context is not None and context.execution_context.executemany,
+                            context.original_exception)
+
+
+@event.listens_for(Mapper, "load")
+def _on_load(target, context):
+    # 每构造完一个 ORM 对象，把距离上一个时间点的耗时计入 orm
+    profile = _current.get()
+    if profile is None or profile.orm_mark is None:
+        return
+    now = time.perf_counter()
+    profile.phases["orm"] += now - profile.orm_mark
+    profile.orm_mark = now
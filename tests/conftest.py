@@ -0,0 +1,22 @@
+"""测试共用：临时 SQLite 数据库上的默认账号池"""
+from pathlib import Path
+import os
+import sys
+import tempfile
+
+# app 在导入时读取数据库配置，必须先设置环境变量
+_tmpdir = tempfile.mkdtemp(prefix="vmq-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'test.db')}"
+os.environ["POOLS_CONFIG"] = os.path.join(_tmpdir, "pools.json")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+import app
+
+
+@pytest.fixture(scope="session")
+def pool():
+    pool = app.POOLS[app.DEFAULT_POOL]
+    app.init_db(pool)
+    return pool
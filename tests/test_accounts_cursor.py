@@ -0,0 +1,57 @@
+"""
+/accounts 带时间范围翻页：第一页算出的 id 范围放在 next_cursor 里，之后的页不再扫描整个时间范围
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, update
+
+import app
+
+
+def test_time_range_pages(pool):
+    client = app.app.test_client()
+    prefix = "cursor"
+    resp = client.post("/add_accounts", json=[f"{prefix}-{i}" for i in range(30)])
+    assert resp.status_code == 201
+    base = datetime(2025, 6, 1)
+    with pool.session() as session:
+        ids = sorted(session.execute(
+            app.select(app.Account.id).where(app.Account.account.like(f"{prefix}-%"))).scalars())
+        for i, row_id in enumerate(ids):
+            session.execute(update(app.Account).where(app.Account.id == row_id)
+                            .values(created_at=base + timedelta(hours=i)))
+        session.commit()
+
+    args = {"created_from": (base + timedelta(hours=5)).isoformat(),
+            "created_to": (base + timedelta(hours=17)).isoformat(), "limit": 5}
+    got = []
+    cursor = None
+    pages = 0
+    range_scans = []
+
+    def count_range_scans(conn, dbapi_cursor, statement, parameters, context, executemany):
+        if "min(" in statement.lower():
+            range_scans.append(pages)
+
+    event.listen(pool.get_engine(), "before_cursor_execute", count_range_scans)
+    try:
+        while True:
+            query = dict(args, **({"after": cursor} if cursor is not None else {}))
+            page = client.get("/accounts", query_string=query).get_json()
+            got += [row["id"] for row in page["data"]]
+            pages += 1
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+            assert ":" in cursor
+    finally:
+        event.remove(pool.get_engine(), "before_cursor_execute", count_range_scans)
+    assert got == ids[5:17]
+    assert pages == 3
+    # 只有第一页读时间范围（accounts、accounts_archive 各一次）
+    assert range_scans == [0, 0]
+
+    # 不带时间范围时游标仍是整数 id
+    page = client.get("/accounts", query_string={"limit": 1}).get_json()
+    assert isinstance(page["next_cursor"], int)
+    assert client.get("/accounts", query_string={"after": "x:1"}).status_code == 400
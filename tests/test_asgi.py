@@ -0,0 +1,96 @@
+"""
+asgi.py：/extract、/stats 走异步引擎（aiosqlite），请求超时被取消时已经分批提交的账号放回池中
+"""
+import functools
+
+import pytest
+from sqlalchemy import func, select
+
+import app
+import metrics
+
+# asgi.py 的依赖是可选的（pip install starlette uvicorn a2wsgi aiomysql），没装时跳过
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("starlette")
+pytest.importorskip("a2wsgi")
+pytest.importorskip("aiosqlite")
+import asgi
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _client():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi.app), base_url="http://test")
+
+
+def _used_by(pool, extractor):
+    with pool.session() as session:
+        return session.execute(
+            select(func.count()).select_from(app.Account)
+            .where(app.Account.status == "used", app.Account.extracted_by == extractor)
+        ).scalar()
+
+
+@pytest.mark.anyio
+async def test_extract_and_stats(pool):
+    resp = app.app.test_client().post("/add_accounts", json=[f"asgi-{i}" for i in range(5)])
+    assert resp.status_code == 201
+
+    def checkouts():
+        if not metrics.ENABLED:
+            return 0
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value("vmq_db_pool_checkouts_total", {"pool": pool.name}) or 0
+
+    before = checkouts()
+    async with _client() as client:
+        resp = await client.post("/extract", json={"count": 2, "extractor": "asgi"})
+        assert resp.status_code == 200
+        assert resp.json()["extracted_count"] == 2
+
+        stats = await client.get("/stats")
+        assert stats.status_code == 200
+        assert stats.json()["used"] >= 2
+    # 异步引擎的连接池也计入 /metrics
+    if metrics.ENABLED:
+        assert checkouts() > before
+
+
+@pytest.mark.anyio
+async def test_cancelled_extract_returns_committed_batches(pool, monkeypatch):
+    extractor = "asgi-cancel"
+    resp = app.app.test_client().post("/add_accounts", json=[f"{extractor}-{i}" for i in range(4)])
+    assert resp.status_code == 201
+
+    # 每批 2 个、同时只认领一批；第一批认领时另一个 extractor 排进队列并一直占着名额，
+    # 第二批排不到队，请求超时被取消
+    monkeypatch.setattr(app, "EXTRACT_MAX_BATCH", 2)
+    monkeypatch.setattr(app, "EXTRACT_CONCURRENCY", 1)
+    monkeypatch.setattr(pool, "extract_scheduler", None)
+    monkeypatch.setattr(asgi, "run_cancellable", functools.partial(asgi.run_cancellable, timeout=0.5))
+
+    claim_accounts = app.claim_accounts
+    blocker = {}
+
+    def claim_and_block(account_pool, session, *args):
+        if not blocker:
+            scheduler = app.get_extract_scheduler(account_pool)
+            blocker["ticket"] = scheduler.enqueue("blocker")
+        claimed = claim_accounts(account_pool, session, *args)
+        blocker.setdefault("claimed", []).append(len(claimed))
+        return claimed
+    monkeypatch.setattr(app, "claim_accounts", claim_and_block)
+
+    try:
+        async with _client() as client:
+            resp = await client.post("/extract", json={"count": 4, "extractor": extractor})
+        assert resp.status_code in (499, 504)
+        assert blocker["claimed"] == [2]
+        # 第一批已经提交，取消后按 id 放回
+        assert _used_by(pool, extractor) == 0
+    finally:
+        if blocker.get("ticket") is not None and blocker["ticket"].granted.is_set():
+            pool.extract_scheduler.release()
@@ -0,0 +1,65 @@
+"""
+/extract 并发认领：多个线程同时提取，同一个账号不能被发给两个请求，数据库里已使用的数量与发出去的一致
+
+    python -m pytest -q tests
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import func, select
+
+import app
+
+THREADS = 8
+REQUESTS_PER_THREAD = 10
+
+
+@pytest.fixture(params=[False, True], ids=["claim", "buffer"])
+def buffered(request, pool, monkeypatch):
+    monkeypatch.setattr(app, "EXTRACT_BUFFER_ENABLED", request.param)
+    pool.extract_buffer = None
+    yield request.param
+    pool.extract_buffer = None
+
+
+def _seed(pool, prefix, n):
+    client = app.app.test_client()
+    resp = client.post("/add_accounts", json=[f"{prefix}-{i}----pw" for i in range(n)])
+    assert resp.status_code == 201, resp.data
+    assert resp.get_json()["added"] == n
+
+
+def _extract_many(extractor, count):
+    client = app.app.test_client()
+    got = []
+    for _ in range(REQUESTS_PER_THREAD):
+        resp = client.post("/extract", json={"count": count, "extractor": extractor})
+        if resp.status_code == 404:
+            # 账号已经提取完
+            continue
+        assert resp.status_code == 200, resp.data
+        got.extend(resp.get_json()["accounts"])
+    return got
+
+
+def _used_count(pool, extractor):
+    with pool.session() as session:
+        return session.execute(
+            select(func.count()).select_from(app.Account)
+            .where(app.Account.status == "used", app.Account.extracted_by == extractor)
+        ).scalar()
+
+
+@pytest.mark.parametrize("count", [1, 3, 7])
+def test_concurrent_extract_no_duplicates(pool, buffered, count):
+    extractor = f"t-{count}-{'buffer' if buffered else 'claim'}"
+    # 账号比请求总量少：最后几个请求会抢同一批剩余账号
+    _seed(pool, extractor, THREADS * REQUESTS_PER_THREAD * count * 3 // 4)
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        results = list(executor.map(lambda _: _extract_many(extractor, count), range(THREADS)))
+    got = [account for result in results for account in result]
+
+    assert got
+    assert len(got) == len(set(got))
+    assert _used_count(pool, extractor) == len(got)
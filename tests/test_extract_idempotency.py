@@ -0,0 +1,23 @@
+"""
+/extract 幂等：同一个请求 id 重试时原样返回第一次的结果（带 Idempotent-Replayed），参数不同时返回 422
+"""
+import app
+
+
+def test_replay_and_mismatch(pool):
+    client = app.app.test_client()
+    resp = client.post("/add_accounts", json=[f"idem-{i}" for i in range(5)])
+    assert resp.status_code == 201
+
+    first = client.post("/extract", json={"count": 2, "extractor": "idem"}, headers={"Idempotency-Key": "idem-1"})
+    assert first.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+
+    replay = client.post("/extract", json={"count": 2, "extractor": "idem"}, headers={"Idempotency-Key": "idem-1"})
+    assert replay.status_code == 200
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.get_json() == first.get_json()
+
+    mismatch = client.post("/extract", json={"count": 3, "extractor": "idem"}, headers={"Idempotency-Key": "idem-1"})
+    assert mismatch.status_code == 422
+    assert "Idempotent-Replayed" not in mismatch.headers
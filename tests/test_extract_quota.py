@@ -0,0 +1,32 @@
+"""
+/extract 配额：extractor_quotas 里单独设置的 rate / burst 在全局不限流（EXTRACT_QUOTA_RATE=0）时也生效
+"""
+from datetime import datetime
+
+import app
+
+
+def _seed(prefix, n):
+    resp = app.app.test_client().post("/add_accounts", json=[f"{prefix}-{i}----pw" for i in range(n)])
+    assert resp.status_code == 201, resp.data
+
+
+def _extract(extractor, count):
+    return app.app.test_client().post("/extract", json={"count": count, "extractor": extractor})
+
+
+def test_per_extractor_quota_without_global_rate(pool, monkeypatch):
+    monkeypatch.setattr(app, "EXTRACT_QUOTA_RATE", 0)
+    _seed("quota", 20)
+    with pool.session() as session:
+        session.add(app.ExtractorQuota(extractor="quota-limited", tokens=5, updated_at=datetime.utcnow(),
+                                       rate=0.001, burst=5))
+        session.commit()
+
+    assert _extract("quota-limited", 3).status_code == 200
+    resp = _extract("quota-limited", 3)
+    assert resp.status_code == 429
+    assert "Retry-After" in resp.headers
+    # 没有单独设置的 extractor 不受影响
+    assert _extract("quota-free", 5).status_code == 200
+    assert _extract("quota-free", 5).status_code == 200
@@ -0,0 +1,64 @@
+"""
+/extract 失败时的补偿：已经分批提交的账号按 id 放回池中，扣掉的配额退还
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+import app
+
+
+def _seed(prefix, n):
+    resp = app.app.test_client().post("/add_accounts", json=[f"{prefix}-{i}----pw" for i in range(n)])
+    assert resp.status_code == 201, resp.data
+
+
+def _status_counts(pool, prefix):
+    with pool.session() as session:
+        return dict(session.execute(
+            select(app.Account.status, func.count())
+            .where(app.Account.account.like(f"{prefix}-%"))
+            .group_by(app.Account.status)
+        ).all())
+
+
+def _tokens(pool, extractor):
+    with pool.session() as session:
+        return session.get(app.ExtractorQuota, extractor).tokens
+
+
+def test_failed_batch_returns_committed_accounts_and_quota(pool, monkeypatch):
+    extractor = "return-batch"
+    _seed(extractor, 10)
+    monkeypatch.setattr(app, "EXTRACT_MAX_BATCH", 3)
+    monkeypatch.setattr(app, "EXTRACT_QUOTA_RATE", 1)
+    monkeypatch.setattr(app, "EXTRACT_QUOTA_BURST", 100)
+
+    # MySQL 的 DATETIME 不保存微秒：放回时不能依赖 extracted_at 与 now 相等
+    class Clock(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime(2026, 1, 1, 0, 0, 0, 123456)
+    monkeypatch.setattr(app, "datetime", Clock)
+
+    calls = []
+    claim_accounts = app.claim_accounts
+
+    def failing_claim(account_pool, session, *args):
+        calls.append(1)
+        if len(calls) == 3:
+            raise RuntimeError("connection lost")
+        rows = claim_accounts(account_pool, session, *args)
+        # 模拟 MySQL 把 extracted_at 舍入到秒
+        session.execute(app.update(app.Account).where(app.Account.id.in_([row_id for row_id, _ in rows]))
+                        .values(extracted_at=datetime(2026, 1, 1)))
+        return rows
+    monkeypatch.setattr(app, "claim_accounts", failing_claim)
+
+    before = _status_counts(pool, extractor)
+    resp = app.app.test_client().post("/extract", json={"count": 8, "extractor": extractor})
+    assert resp.status_code == 500
+    assert resp.get_json()["error"] == "connection lost"
+    assert _status_counts(pool, extractor) == before
+    assert _tokens(pool, extractor) == pytest.approx(100, abs=1)
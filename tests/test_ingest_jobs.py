@@ -0,0 +1,49 @@
+"""
+异步入库任务：所在 worker 退出后（任务随内存中的线程池丢失）心跳停止，/jobs/<id> 报告失败
+"""
+from datetime import datetime, timedelta
+import time
+
+import app
+
+
+def _job(client, job_id):
+    resp = client.get(f"/jobs/{job_id}")
+    assert resp.status_code == 200, resp.data
+    return resp.get_json()
+
+
+def test_async_job_finishes(pool):
+    client = app.app.test_client()
+    resp = client.post("/add_accounts?async=1", json=[f"job-{i}" for i in range(10)])
+    assert resp.status_code == 202
+    job_id = resp.get_json()["job_id"]
+    for _ in range(100):
+        job = _job(client, job_id)
+        if job["status"] == "done":
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done"
+    assert job["added"] == 10
+
+
+def test_job_of_exited_worker_is_failed(pool):
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=app.INGEST_JOB_STALE_AFTER + 1)
+    with pool.session() as session:
+        session.add(app.IngestJob(id="stale-running", status="running", owner="gone:1:x",
+                                  created_at=stale, started_at=stale, heartbeat_at=stale))
+        session.add(app.IngestJob(id="stale-queued", status="queued", owner="gone:1:x",
+                                  created_at=stale, heartbeat_at=stale))
+        session.add(app.IngestJob(id="alive", status="running", owner="other:2:y",
+                                  created_at=now, started_at=now, heartbeat_at=now))
+        session.commit()
+
+    client = app.app.test_client()
+    job = _job(client, "stale-running")
+    assert job["status"] == "failed"
+    assert job["error"]
+
+    assert app.check_ingest_jobs(pool) == 1
+    assert _job(client, "stale-queued")["status"] == "failed"
+    assert _job(client, "alive")["status"] == "running"
@@ -1,23 +1,128 @@
 import tkinter as tk
-from tkinter import messagebox, scrolledtext
+from tkinter import filedialog, messagebox, scrolledtext
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import threading
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
+import json
 import os
 from pathlib import Path
+import sqlite3
 import sys
+import tempfile
 
 # ----------------------------
 # 配置
 # ----------------------------
-# BASE_URL = "http://localhost:5500"  # 请根据实际修改
-# BASE_URL = "http://47.243.215.58:5500"  # 请根据实际修改
-# BASE_URL = "http://8.210.94.60:5500"  # 请根据实际修改
-BASE_URL = "http://111.231.25.166:8000"  # 请根据实际修改
-
-REFRESH_INTERVAL = 5000  # 5秒，单位毫秒
+# 服务器地址：环境变量 VMQ_BASE_URL > exe 同级 config.json 的 "base_url" > 默认值
+DEFAULT_BASE_URL = "http://111.231.25.166:8000"
+CONFIG_FILE = "config.json"
+
+HTTP_WORKERS = 4  # 后台请求线程数（添加 / 导出 / 刷新统计共用）
+HTTP_POOL_SIZE = 8  # 保持的长连接数
+HTTP_RETRIES = 2  # GET 请求在连接失败 / 502 / 503 / 504 时的重试次数
+
+REFRESH_INTERVAL = 5000  # 5秒，单位毫秒（统计订阅断开后退回轮询的初始间隔）
+REFRESH_MAX_INTERVAL = 60000  # 轮询退避的最大间隔，单位毫秒
+WATCH_TIMEOUT = 25  # 服务器挂起 /stats/watch 的最长时间，单位秒
+UPLOAD_CHUNK_SIZE = 5000  # 每个上传请求的账号数
+UPLOAD_WORKERS = 3  # 同时上传的请求数
+UPLOAD_RETRIES = 3  # 单个分块失败后的重试次数（只重试失败的分块）
+UPLOAD_TIMEOUT = (10, 60)  # 单个分块的（连接超时，读取超时），单位秒
+LOCAL_STORE_FILE = "accounts_cache.db"  # 本地账号缓存（exe 同级），导出时增量同步
+EXPORT_READ_CHUNK = 64 * 1024  # 下载时每次读取的字节数（读取之间可以取消）
+EXPORT_TIMEOUT = (10, 60)  # 单页同步的（连接超时，读取超时），单位秒
+EXPORT_PROGRESS_EVERY = 5000  # 写文件时每写多少行刷新一次进度
+
+
+class ExportCancelled(Exception):
+    """用户取消了导出"""
+
+
+class ApiClient:
+    """
+    访问服务器的共享客户端：一个带连接池的 requests.Session（长连接复用，GET 自动重试），
+    加一个固定大小的线程池执行后台请求，避免每次操作都新建连接和线程。
+    """
+
+    def __init__(self, base_url, workers=HTTP_WORKERS, pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, connect=retries, read=0, backoff_factor=0.5,
+                              status_forcelist=(502, 503, 504), allowed_methods={"GET"},
+                              raise_on_status=False)
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.closed = threading.Event()
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vmq-http")
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def get(self, path, **kwargs):
+        return self.session.get(self.base_url + path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.session.post(self.base_url + path, **kwargs)
+
+    def submit(self, fn, *args):
+        """在后台线程池里执行 fn(*args)"""
+        return self._executor.submit(fn, *args)
+
+    def submit_once(self, key, fn, *args):
+        """同一个 key 已有任务在执行或排队时直接返回那个任务，不重复提交（合并重叠的刷新）"""
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None and not future.done():
+                return future
+            future = self._executor.submit(fn, *args)
+            self._inflight[key] = future
+            return future
+
+    def close(self):
+        self.closed.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+# 导出文件的表头行，重新导入导出文件时跳过
+EXPORT_HEADER_PREFIXES = ("====", "数据导出时间:", "总记录数:")
+
+
+def iter_input_accounts(lines):
+    """
+    逐行解析输入（粘贴的文本或打开的文件），跳过空行和导出文件的表头。
+    每行整行作为一个账号（包括导出的 account----name 格式），不在内存里拼出整个列表。
+    """
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith(EXPORT_HEADER_PREFIXES):
+            yield line
+
+
+def load_base_url():
+    """读取服务器地址配置"""
+    url = os.getenv("VMQ_BASE_URL")
+    if url:
+        return url
+    config_path = get_config_path(CONFIG_FILE)
+    if config_path.exists():
+        try:
+            with open(config_path, encoding='utf-8') as f:
+                url = json.load(f).get("base_url")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 无法读取配置文件 {config_path}: {e}")
+        if url:
+            return url
+    return DEFAULT_BASE_URL
 
 
 def resource_path(relative_path):
@@ -39,6 +144,62 @@ def get_config_path(filename):
         return Path(__file__).parent / filename
 
 
+class LocalAccountStore:
+    """本地账号缓存（SQLite），通过服务器的 /changes 增量同步，导出时直接从这里读取"""
+
+    def __init__(self, path, base_url):
+        self.path = str(path)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS accounts (
+                    id INTEGER PRIMARY KEY,
+                    account TEXT NOT NULL,
+                    status TEXT,
+                    created_at TEXT,
+                    extracted_by TEXT,
+                    extracted_at TEXT
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # 换了服务器地址时本地缓存作废，重新全量同步
+            row = conn.execute("SELECT value FROM meta WHERE key = 'base_url'").fetchone()
+            if row is None or row[0] != base_url:
+                conn.execute("DELETE FROM accounts")
+                conn.execute("DELETE FROM meta")
+                conn.execute("INSERT INTO meta (key, value) VALUES ('base_url', ?)", (base_url,))
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def get_token(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'token'").fetchone()
+        return row[0] if row else None
+
+    def apply(self, changes, token):
+        """按 id 覆盖写入一批变化，并在同一个事务里保存同步位置"""
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO accounts (id, account, status, created_at, extracted_by, extracted_at) "
+                "VALUES (:id, :account, :status, :created_at, :extracted_by, :extracted_at)",
+                changes
+            )
+            if token:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('token', ?)", (token,))
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+
+    def iter_accounts(self):
+        conn = self._connect()
+        try:
+            for (account,) in conn.execute("SELECT account FROM accounts ORDER BY id"):
+                yield account
+        finally:
+            conn.close()
+
+
 class AccountManagerGUI:
     def __init__(self, root):
         self.root = root
@@ -52,6 +213,16 @@ class AccountManagerGUI:
         self.font_title = ("Microsoft YaHei", 14, "bold")
         self.font_card = ("Microsoft YaHei", 12, "bold")
 
+        # 所有请求共用的连接池和后台线程池
+        self.api = ApiClient(load_base_url())
+
+        # 上次 /stats 响应的 ETag
+        self._stats_etag = None
+        # 统计轮询间隔（秒）：请求超时或连不上时自动加倍，成功后恢复
+        self._stats_interval = REFRESH_INTERVAL / 1000
+        # 正在进行的导出（点击“取消导出”时置位）
+        self._export_cancel = None
+
         # 创建界面
         self.create_widgets()
 
@@ -111,6 +282,17 @@ class AccountManagerGUI:
             width=15
         )
         self.export_btn.pack(side=LEFT)
+
+        self.export_progress = ttk.Progressbar(
+            action_frame,
+            mode=DETERMINATE,
+            bootstyle=INFO,
+            length=300
+        )
+        self.export_progress.pack(side=LEFT, padx=(15, 10))
+
+        self.export_status = ttk.Label(action_frame, text="", font=self.font_normal)
+        self.export_status.pack(side=LEFT)
         
         # ===== 添加账号区域 =====
         add_frame = ttk.Labelframe(main_frame, text="批量添加账号", padding=15)
@@ -136,6 +318,18 @@ class AccountManagerGUI:
         )
         self.add_btn.pack(side=RIGHT)
 
+        self.add_file_btn = ttk.Button(
+            add_frame,
+            text="从文件添加",
+            bootstyle=(SUCCESS, OUTLINE),
+            command=self.add_accounts_from_file,
+            width=15
+        )
+        self.add_file_btn.pack(side=RIGHT, padx=(0, 10))
+
+        self.add_status = ttk.Label(add_frame, text="", font=self.font_normal)
+        self.add_status.pack(side=LEFT)
+
         # ===== 日志区域 =====
         log_frame = ttk.Labelframe(main_frame, text="操作日志", padding=15)
         log_frame.pack(fill=BOTH, expand=YES)
@@ -193,134 +387,356 @@ class AccountManagerGUI:
         self.log_text.config(state=DISABLED)
 
     def add_accounts(self):
-        raw = self.account_input.get("1.0", tk.END).strip()
-        if not raw:
+        raw = self.account_input.get("1.0", tk.END)
+        if not raw.strip():
             messagebox.showwarning("输入为空", "请输入至少一个账号（每行一个）", parent=self.root)
             return
 
-        accounts = [line.strip() for line in raw.splitlines() if line.strip()]
-        if not accounts:
-            messagebox.showwarning("无效输入", "没有有效的账号内容", parent=self.root)
+        self._start_upload("输入框", lambda: iter_input_accounts(raw.splitlines()))
+
+    def add_accounts_from_file(self):
+        """直接从文件逐行读取并上传，大文件不需要先粘贴到输入框"""
+        path = filedialog.askopenfilename(
+            parent=self.root,
+            title="选择账号文件",
+            filetypes=[("文本文件", "*.txt"), ("所有文件", "*.*")]
+        )
+        if not path:
             return
 
-        self.add_btn.config(state=DISABLED, text="处理中...")
-        self.log(f"正在添加 {len(accounts)} 个账号，请稍候...")
+        def open_lines():
+            with open(path, encoding='utf-8-sig', errors='replace') as f:
+                yield from iter_input_accounts(f)
 
+        self._start_upload(os.path.basename(path), open_lines)
+
+    def _start_upload(self, source, open_accounts):
+        self.add_btn.config(state=DISABLED, text="处理中...")
+        self.add_file_btn.config(state=DISABLED)
+        self.log(f"正在从{source}读取并上传账号，请稍候...")
         self.root.update_idletasks()
 
-        threading.Thread(target=self._add_accounts_thread, args=(accounts,), daemon=True).start()
+        self.api.submit(self._add_accounts_thread, open_accounts)
 
-    def _add_accounts_thread(self, accounts):
-        try:
-            response = requests.post(f"{BASE_URL}/add_accounts", json=accounts, timeout=15)
+    def _set_add_status(self, text):
+        self.root.after(0, lambda: self.add_status.config(text=text))
+
+    def _upload_chunk(self, chunk):
+        """上传一个分块，失败时按退避重试，返回 (新增数, 跳过数)；重试用完仍失败则抛出异常"""
+        error = None
+        for attempt in range(UPLOAD_RETRIES + 1):
+            if attempt and self.api.closed.wait(2 ** (attempt - 1)):
+                break
+            try:
+                response = self.api.post("/add_accounts", json=chunk, timeout=UPLOAD_TIMEOUT)
+            except requests.RequestException as e:
+                error = str(e)
+                continue
             if response.status_code == 201:
                 data = response.json()
-                msg = f"成功添加 {data['message']}，跳过 {data['skipped_due_to_duplicate_or_exist']} 个重复项。"
-                self.log(msg)
-            else:
+                return data["added"], data["skipped_due_to_duplicate_or_exist"]
+            try:
                 error = response.json().get("error", "未知错误")
-                self.log(f"添加失败: {error}")
+            except ValueError:
+                error = f"HTTP {response.status_code}"
+            if response.status_code < 500:
+                break  # 请求本身有问题，重试也没用
+        raise RuntimeError(error)
+
+    def _add_accounts_thread(self, open_accounts):
+        """
+        边读边去重边上传：按 UPLOAD_CHUNK_SIZE 分块，最多 UPLOAD_WORKERS 个分块同时上传，
+        正在上传的分块数有上限，大文件也不会一次读进内存。失败的分块在最后列出，可以单独重试。
+        """
+        seen = set()
+        local_dups = 0
+        added = skipped = 0
+        uploaded = 0
+        failed = []
+
+        def collect(done):
+            nonlocal added, skipped, uploaded
+            for future in done:
+                chunk = pending.pop(future)
+                try:
+                    chunk_added, chunk_skipped = future.result()
+                except Exception as e:
+                    failed.append(chunk)
+                    self.log(f"有 {len(chunk)} 个账号上传失败: {e}")
+                    continue
+                added += chunk_added
+                skipped += chunk_skipped
+                uploaded += len(chunk)
+            self._set_add_status(f"已上传 {uploaded} 个，新增 {added}，跳过 {skipped + local_dups}")
+
+        try:
+            with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="vmq-upload") as executor:
+                pending = {}
+                chunk = []
+                for account in open_accounts():
+                    if account in seen:
+                        local_dups += 1
+                        continue
+                    seen.add(account)
+                    chunk.append(account)
+                    if len(chunk) >= UPLOAD_CHUNK_SIZE:
+                        pending[executor.submit(self._upload_chunk, chunk)] = chunk
+                        chunk = []
+                        if len(pending) >= UPLOAD_WORKERS * 2:
+                            collect(wait(pending, return_when=FIRST_COMPLETED).done)
+                if chunk:
+                    pending[executor.submit(self._upload_chunk, chunk)] = chunk
+                if not seen:
+                    self.log("没有有效的账号内容")
+                    return
+                while pending:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+
+            self.log(f"成功添加 {added}个账号，跳过 {skipped} 个已存在的账号，"
+                     f"{local_dups} 个输入中重复的账号。")
+            if failed:
+                self._offer_retry(failed)
         except Exception as e:
-            self.log(f"网络异常: {str(e)}")
+            self.log(f"添加失败: {str(e)}（已新增 {added} 个）")
         finally:
-            self.root.after(0, lambda: self.add_btn.config(state=NORMAL, text="添加账号"))
+            def reset():
+                self.add_btn.config(state=NORMAL, text="添加账号")
+                self.add_file_btn.config(state=NORMAL)
+            self.root.after(0, reset)
 
-    def fetch_stats(self):
-        threading.Thread(target=self._fetch_stats_thread, daemon=True).start()
+    def _offer_retry(self, failed):
+        """询问是否只重试失败的分块"""
+        count = sum(len(chunk) for chunk in failed)
+        self.log(f"{len(failed)} 个分块（{count} 个账号）上传失败")
 
+        def ask():
+            if messagebox.askyesno("部分上传失败", f"有 {count} 个账号上传失败，是否重试这些账号？", parent=self.root):
+                self._start_upload("失败的分块", lambda: (account for chunk in failed for account in chunk))
+        self.root.after(0, ask)
+
+    def refresh_stats(self):
+        """刷新统计；已有刷新请求在进行时合并为同一个请求"""
+        return self.api.submit_once("stats", self._fetch_stats_thread)
 
     def _fetch_stats_thread(self):
         try:
-            response = requests.get(f"{BASE_URL}/stats", timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                total = str(data.get('total', 0))
-                used = str(data.get('used', 0))
-                unused = str(data.get('unused', 0))
+            # 带上次的 ETag，服务器统计没变化时返回 304，不用更新界面
+            headers = {"If-None-Match": self._stats_etag} if self._stats_etag else {}
+            response = self.api.get("/stats", headers=headers, timeout=5)
+        except (requests.Timeout, requests.ConnectionError):
+            # 服务器慢或连不上：拉长轮询间隔，减轻服务器压力
+            self._stats_interval = min(self._stats_interval * 2, REFRESH_MAX_INTERVAL / 1000)
+            self._update_stats_error()
+            return
+        except Exception:
+            self._update_stats_error()
+            return
 
-                self.root.after(0, lambda: self.总计_value_label.config(text=total))
-                self.root.after(0, lambda: self.已使用_value_label.config(text=used))
-                self.root.after(0, lambda: self.未使用_value_label.config(text=unused))
+        self._stats_interval = REFRESH_INTERVAL / 1000
+        try:
+            if response.status_code == 304:
+                return
+            if response.status_code == 200:
+                self._stats_etag = response.headers.get("ETag")
+                self._show_stats(response.json())
             else:
                 self._update_stats_error()
         except Exception:
             self._update_stats_error()
 
+    def _show_stats(self, data):
+        total = str(data.get('total', 0))
+        used = str(data.get('used', 0))
+        unused = str(data.get('unused', 0))
+
+        self.root.after(0, lambda: self.总计_value_label.config(text=total))
+        self.root.after(0, lambda: self.已使用_value_label.config(text=used))
+        self.root.after(0, lambda: self.未使用_value_label.config(text=unused))
+
     def _update_stats_error(self):
+        self._stats_etag = None
         self.root.after(0, lambda: self.总计_value_label.config(text="--"))
         self.root.after(0, lambda: self.已使用_value_label.config(text="--"))
         self.root.after(0, lambda: self.未使用_value_label.config(text="--"))
 
 
     def auto_refresh_stats(self):
-        self.fetch_stats()
-        self.root.after(REFRESH_INTERVAL, self.auto_refresh_stats)
+        """
+        启动统计订阅线程（整个程序只保持一个到 /stats/watch 的长轮询）。
+        订阅会一直挂起，所以单独用一个守护线程，不占用请求线程池。
+        """
+        threading.Thread(target=self._watch_stats_thread, name="vmq-stats-watch", daemon=True).start()
+
+    def _watch_stats_thread(self):
+        version = None
+        while not self.api.closed.is_set():
+            try:
+                params = {"timeout": WATCH_TIMEOUT}
+                if version is not None:
+                    params["since"] = version
+                response = self.api.get("/stats/watch", params=params, timeout=WATCH_TIMEOUT + 10)
+                if response.status_code == 304:
+                    continue
+                if response.status_code == 200:
+                    data = response.json()
+                    version = data.get("version")
+                    self._show_stats(data)
+                    self._stats_interval = REFRESH_INTERVAL / 1000
+                    continue
+            except Exception:
+                pass
+
+            # 订阅断开（或旧版服务器没有 /stats/watch）：普通查询一次，等待后重新订阅；
+            # 等待间隔由 _fetch_stats_thread 按超时情况自动退避
+            try:
+                self.refresh_stats().result()
+            except Exception:
+                pass
+            self.api.closed.wait(self._stats_interval)
+
+    def close(self):
+        """关闭窗口：取消进行中的导出，关闭连接池和后台线程"""
+        if self._export_cancel is not None:
+            self._export_cancel.set()
+        self.api.close()
+        self.root.destroy()
 
     def export_data(self):
-        """导出数据到txt文件"""
-        self.export_btn.config(state=DISABLED, text="导出中...")
+        """导出数据到txt文件；导出过程中再次点击则取消"""
+        if self._export_cancel is not None:
+            self._export_cancel.set()
+            self.export_btn.config(state=DISABLED, text="正在取消...")
+            return
+
+        self._export_cancel = threading.Event()
+        self.export_btn.config(text="取消导出")
         self.log("正在导出数据，请稍候...")
         self.root.update_idletasks()
-        
-        threading.Thread(target=self._export_data_thread, daemon=True).start()
 
-    def _export_data_thread(self):
-        """导出数据的后台线程"""
+        self.api.submit(self._export_data_thread, self._export_cancel)
+
+    def _set_export_progress(self, text, value=None, maximum=None):
+        """在主线程里更新导出进度条和状态文字；value 为 None 时进度条显示为“忙碌”"""
+        def update():
+            if value is None:
+                if str(self.export_progress.cget("mode")) != INDETERMINATE:
+                    self.export_progress.config(mode=INDETERMINATE)
+                    self.export_progress.start(15)
+            else:
+                self.export_progress.stop()
+                self.export_progress.config(mode=DETERMINATE, maximum=max(maximum or 1, 1), value=value)
+            self.export_status.config(text=text)
+        self.root.after(0, update)
+
+    def _export_data_thread(self, cancel):
+        """导出数据的后台线程：先从服务器增量同步到本地缓存，再由本地缓存写文件"""
         try:
-            response = requests.get(f"{BASE_URL}/export", timeout=30)
-            if response.status_code == 200:
-                data = response.json()
-                accounts_data = data.get('data', [])
-                total = data.get('total', 0)
-                
-                if total == 0:
-                    self.root.after(0, lambda: messagebox.showinfo("提示", "数据库中没有数据可导出", parent=self.root))
-                    self.log("导出失败: 数据库中没有数据")
-                else:
-                    # 生成文件名（当天时间）
-                    today = datetime.now().strftime("%Y-%m-%d")
-                    filename = f"数据导出_{today}.txt"
-                    
-                    # 获取保存路径（exe同级目录或脚本同级目录）
-                    save_path = get_config_path(filename)
-                    
-                    # 写入文件
-                    with open(save_path, 'w', encoding='utf-8') as f:
-                        # 写入表头
-                        f.write("=" * 80 + "\n")
-                        f.write(f"数据导出时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                        f.write(f"总记录数: {total}\n")
-                        f.write("=" * 80 + "\n\n")
-                        
-                        # 写入数据
-                        for idx, acc in enumerate(accounts_data, 1):
-                            # f.write(f"记录 {idx}:\n")
-                            # f.write(f"  ID: {acc.get('id', 'N/A')}\n")
-                            f.write(f"{acc.get('account', 'N/A')}\n")
-                            # f.write(f"  状态: {acc.get('status', 'N/A')}\n")
-                            # f.write(f"  创建时间: {acc.get('created_at', 'N/A')}\n")
-                            # f.write(f"  提取人: {acc.get('extracted_by', 'N/A') or 'N/A'}\n")
-                            # f.write(f"  提取时间: {acc.get('extracted_at', 'N/A') or 'N/A'}\n")
-                            # f.write("-" * 80 + "\n")
-                    
-                    self.log(f"数据导出成功！共导出 {total} 条记录")
-                    self.log(f"文件保存位置: {save_path}")
-                    self.root.after(0, lambda: messagebox.showinfo(
-                        "导出成功", 
-                        f"数据导出成功！\n共导出 {total} 条记录\n\n文件保存位置:\n{save_path}",
-                        parent=self.root
-                    ))
+            store = LocalAccountStore(get_config_path(LOCAL_STORE_FILE), self.api.base_url)
+            if store.get_token():
+                self.log("从上次同步的位置继续同步...")
+            changed = self._sync_local_store(store, cancel)
+            self.log(f"同步完成，本次更新 {changed} 条记录")
+
+            total = store.count()
+            if total == 0:
+                self.root.after(0, lambda: messagebox.showinfo("提示", "数据库中没有数据可导出", parent=self.root))
+                self.log("导出失败: 数据库中没有数据")
             else:
-                error = response.json().get("error", "未知错误")
-                self.log(f"导出失败: {error}")
-                self.root.after(0, lambda: messagebox.showerror("导出失败", f"导出失败: {error}", parent=self.root))
+                save_path = self._write_export_file(store.iter_accounts(), total, cancel)
+                self.log(f"数据导出成功！共导出 {total} 条记录")
+                self.log(f"文件保存位置: {save_path}")
+                self.root.after(0, lambda: messagebox.showinfo(
+                    "导出成功",
+                    f"数据导出成功！\n共导出 {total} 条记录\n\n文件保存位置:\n{save_path}",
+                    parent=self.root
+                ))
+        except ExportCancelled:
+            # 已同步的部分保存在本地缓存里，下次导出从中断处继续
+            self.log("导出已取消，已同步的数据会在下次导出时继续使用")
         except Exception as e:
             error_msg = str(e)
-            self.log(f"导出异常: {error_msg}")
+            self.log(f"导出异常: {error_msg}（已同步的部分下次导出时继续）")
             self.root.after(0, lambda: messagebox.showerror("导出异常", f"导出时发生异常: {error_msg}", parent=self.root))
         finally:
-            self.root.after(0, lambda: self.export_btn.config(state=NORMAL, text="导出数据"))
-
+            def reset():
+                self._export_cancel = None
+                self.export_progress.stop()
+                self.export_progress.config(mode=DETERMINATE, value=0)
+                self.export_status.config(text="")
+                self.export_btn.config(state=NORMAL, text="导出数据")
+            self.root.after(0, reset)
+
+    def _sync_local_store(self, store, cancel):
+        """
+        从 /changes 拉取上次同步之后的变化并写入本地缓存，返回更新的记录数。
+        每页响应边下载边检查取消；每页写入缓存时同时保存同步位置，中断后从最后收到的记录继续。
+        """
+        changed = 0
+        received_bytes = 0
+        while True:
+            params = {"since": store.get_token()} if store.get_token() else {}
+            with self.api.get("/changes", params=params, timeout=EXPORT_TIMEOUT, stream=True) as response:
+                if response.status_code == 404:
+                    raise RuntimeError("服务器不支持增量同步（/changes），请先升级服务器")
+                if response.status_code != 200:
+                    raise RuntimeError(response.json().get("error", "未知错误"))
+                body = bytearray()
+                for chunk in response.iter_content(EXPORT_READ_CHUNK):
+                    if cancel.is_set():
+                        raise ExportCancelled()
+                    body.extend(chunk)
+                    self._set_export_progress(
+                        f"同步中：{changed} 条，{(received_bytes + len(body)) / 1024 / 1024:.1f} MB")
+                received_bytes += len(body)
+                data = json.loads(body)
+
+            store.apply(data["changes"], data["next"])
+            changed += len(data["changes"])
+            self._set_export_progress(f"同步中：{changed} 条，{received_bytes / 1024 / 1024:.1f} MB")
+            if not data["has_more"]:
+                return changed
+            if cancel.is_set():
+                raise ExportCancelled()
+
+    def _write_export_file(self, accounts, total, cancel):
+        """
+        把账号写入 数据导出_<日期>.txt，返回文件路径。
+        先写到同目录的临时文件，写完再替换，中途失败或取消不会覆盖已有的导出文件。
+        """
+        # 生成文件名（当天时间）
+        today = datetime.now().strftime("%Y-%m-%d")
+        filename = f"数据导出_{today}.txt"
+
+        # 获取保存路径（exe同级目录或脚本同级目录）
+        save_path = get_config_path(filename)
+
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{filename}.", suffix=".part", dir=save_path.parent)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                # 写入表头
+                f.write("=" * 80 + "\n")
+                f.write(f"数据导出时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+                f.write(f"总记录数: {total}\n")
+                f.write("=" * 80 + "\n\n")
+
+                # 写入数据
+                for written, account in enumerate(accounts, 1):
+                    f.write(f"{account}\n")
+                    if written % EXPORT_PROGRESS_EVERY == 0:
+                        if cancel.is_set():
+                            raise ExportCancelled()
+                        self._set_export_progress(f"写入文件：{written} / {total}", written, total)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, save_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._set_export_progress(f"写入文件：{total} / {total}", total, total)
+        return save_path
 
 if __name__ == "__main__":
     root = ttk.Window(
@@ -338,4 +754,5 @@ if __name__ == "__main__":
     style.configure("TLabelframe.Label", font=("Microsoft YaHei", 11, "bold"))
 
     app = AccountManagerGUI(root)
+    root.protocol("WM_DELETE_WINDOW", app.close)
     root.mainloop()
\ No newline at end of file